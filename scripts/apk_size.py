@@ -0,0 +1,162 @@
+"""APK size breakdown analyzer.
+
+Streams an APK's zip directory (or walks a decoded tree) and reports
+compressed and uncompressed bytes by ABI, density qualifier, resource type,
+dex and assets. Given a candidate build rules file it also projects how many
+bytes architectures.strip and dpi.keep would remove.
+"""
+import argparse
+import json
+import sys
+import zipfile
+from pathlib import Path
+import yaml
+from density import density_qualifier, is_filtered_res_path
+
+CATEGORIES = ["abi", "density", "resource_type", "dex", "assets", "other"]
+
+def iter_sizes(path):
+    """Yield (relative posix path, compressed bytes or None, uncompressed bytes)"""
+    path = Path(path)
+    if path.is_dir():
+        for f in path.rglob("*"):
+            if f.is_file():
+                yield f.relative_to(path).as_posix(), None, f.stat().st_size
+    else:
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    yield info.filename, info.compress_size, info.file_size
+
+def classify(name):
+    """Map an entry path to {category: key} for every category it counts towards"""
+    parts = name.split('/')
+    dirs = parts[:-1]
+    groups = {}
+
+    if "lib" in dirs:
+        idx = dirs.index("lib")
+        if idx + 1 < len(dirs):
+            groups["abi"] = dirs[idx + 1]
+
+    if "res" in dirs:
+        # The first qualified directory below res/ (e.g. drawable-xxhdpi) names the type
+        for res_dir in dirs[dirs.index("res") + 1:]:
+            groups["resource_type"] = res_dir.split('-')[0]
+            qualifier = density_qualifier(res_dir)
+            if qualifier:
+                groups["density"] = qualifier
+                break
+            if '-' in res_dir:
+                break
+
+    if parts[-1].endswith(".dex"):
+        groups["dex"] = parts[-1]
+    if "assets" in dirs:
+        asset_dirs = dirs[dirs.index("assets") + 1:]
+        groups["assets"] = asset_dirs[0] if asset_dirs else "."
+
+    if not groups:
+        groups["other"] = parts[0] if dirs else parts[-1]
+    return groups
+
+def removed_by_rules(name, strip_archs, keep_dpis):
+    """Whether a candidate rule set would remove this entry"""
+    dirs = name.split('/')[:-1]
+    if "lib" in dirs:
+        idx = dirs.index("lib")
+        if idx + 1 < len(dirs) and dirs[idx + 1] in strip_archs:
+            return True
+    # Same rule as filter_dpi_resources: only res/<group>/<dir> below the root
+    return is_filtered_res_path(dirs, keep_dpis)
+
+def load_candidate_rules(rules_file):
+    """Read architectures.strip and dpi.keep from a build_rules-style file"""
+    with open(rules_file) as f:
+        rules = yaml.safe_load(f) or {}
+    rules = rules.get('global', rules)
+    strip_archs = rules.get('architectures', {}).get('strip', []) or []
+    keep_dpis = rules.get('dpi', {}).get('keep', []) or []
+    return strip_archs, keep_dpis
+
+def analyze(path, rules_file=None):
+    """Build the size report for an APK or decoded tree"""
+    breakdown = {category: {} for category in CATEGORIES}
+    total = {"compressed": 0, "uncompressed": 0, "entries": 0}
+    savings = {"compressed": 0, "uncompressed": 0, "entries": 0}
+    strip_archs, keep_dpis = load_candidate_rules(rules_file) if rules_file else ([], [])
+
+    for name, compressed, uncompressed in iter_sizes(path):
+        compressed = compressed or 0
+        _add(total, compressed, uncompressed)
+        for category, key in classify(name).items():
+            bucket = breakdown[category].setdefault(key, {"compressed": 0, "uncompressed": 0, "entries": 0})
+            _add(bucket, compressed, uncompressed)
+        if rules_file and removed_by_rules(name, strip_archs, keep_dpis):
+            _add(savings, compressed, uncompressed)
+
+    report = {"path": str(path), "total": total, "breakdown": breakdown}
+    if rules_file:
+        report["simulation"] = {
+            "rules": str(rules_file),
+            "strip": strip_archs,
+            "keep_dpi": keep_dpis,
+            "savings": savings,
+        }
+    return report
+
+def _add(bucket, compressed, uncompressed):
+    bucket["compressed"] += compressed
+    bucket["uncompressed"] += uncompressed
+    bucket["entries"] += 1
+
+def format_bytes(size):
+    for unit in ["B", "KiB", "MiB"]:
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+def print_report(report, top=10):
+    total = report["total"]
+    print(f"{report['path']}: {total['entries']} entries, "
+          f"{format_bytes(total['compressed'])} compressed, {format_bytes(total['uncompressed'])} uncompressed")
+    for category in CATEGORIES:
+        buckets = report["breakdown"][category]
+        if not buckets:
+            continue
+        print(f"\n{category}:")
+        ranked = sorted(buckets.items(), key=lambda item: (item[1]["compressed"], item[1]["uncompressed"]), reverse=True)
+        for key, bucket in ranked[:top]:
+            print(f"  {key:<32} {format_bytes(bucket['compressed']):>12} {format_bytes(bucket['uncompressed']):>12} "
+                  f"{bucket['entries']:>7} entries")
+        if len(ranked) > top:
+            print(f"  ... {len(ranked) - top} more")
+
+    simulation = report.get("simulation")
+    if simulation:
+        savings = simulation["savings"]
+        share = savings["compressed"] / total["compressed"] * 100 if total["compressed"] else 0
+        print(f"\nProjected savings with {simulation['rules']} "
+              f"(strip={simulation['strip']}, keep_dpi={simulation['keep_dpi']}):")
+        print(f"  {savings['entries']} entries, {format_bytes(savings['compressed'])} compressed ({share:.1f}%), "
+              f"{format_bytes(savings['uncompressed'])} uncompressed")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report APK size by ABI, density, resource type, dex and assets")
+    parser.add_argument("path", help="APK file or decoded directory")
+    parser.add_argument("--rules", help="Candidate build rules file to simulate")
+    parser.add_argument("--top", type=int, default=10, help="Rows to show per category")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    try:
+        report = analyze(args.path, args.rules)
+    except (OSError, zipfile.BadZipFile, yaml.YAMLError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report, args.top)
@@ -0,0 +1,321 @@
+"""Offline benchmark suite.
+
+Generates synthetic fixtures at a configurable scale (decoded trees with many
+qualified res/ directories and XML files, multi-ABI APKs, large patches.json
+files in both compatiblePackages formats) and stand-in java/apkmd/xmllint
+executables, then times the hot functions and the whole pipeline without any
+network access. Results are written as JSON and can be compared to a previous
+run to spot regressions across commits.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+ABIS = ["armeabi-v7a", "arm64-v8a", "x86", "x86_64"]
+DENSITIES = ["ldpi", "mdpi", "hdpi", "xhdpi", "xxhdpi", "xxxhdpi", "120dpi", "160dpi", "240dpi", "320dpi", "480dpi"]
+RES_TYPES = ["drawable", "mipmap", "layout", "raw"]
+
+XML_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<!-- generated fixture {i} -->
+<LinearLayout xmlns="urn:empty" xmlns:android="http://schemas.android.com/apk/res/android"
+    android:layout_width="match_parent" android:layout_height="wrap_content">
+{children}
+</LinearLayout>
+"""
+
+# Stand-in tools. Each one mimics just enough of the real CLI for the scripts.
+STUB_JAVA = r'''#!/usr/bin/env python3
+"""Stand-in for `java -jar APKEditor.jar d|b|m` and `java -jar revanced-cli-all.jar patch`"""
+import shutil, sys, zipfile
+from pathlib import Path
+
+args = sys.argv[1:]
+while args and args[0] != "-jar":
+    args.pop(0)
+jar, command, rest = args[1], args[2], args[3:]
+
+def opt(flag):
+    return rest[rest.index(flag) + 1]
+
+if command == "d":
+    with zipfile.ZipFile(opt("-i")) as zf:
+        zf.extractall(opt("-o"))
+elif command == "b":
+    removed = [rest[i + 1] for i, a in enumerate(rest) if a == "--remove-lib"]
+    src = Path(opt("-i"))
+    with zipfile.ZipFile(opt("-o"), "w", zipfile.ZIP_DEFLATED) as zf:
+        for f in sorted(src.rglob("*")):
+            name = f.relative_to(src).as_posix()
+            if f.is_file() and not any(name.startswith(f"lib/{abi}/") for abi in removed):
+                zf.write(f, name)
+elif command == "m":
+    with zipfile.ZipFile(opt("-i")) as zf:
+        base = next(n for n in zf.namelist() if n.endswith("base.apk"))
+        Path(opt("-o")).write_bytes(zf.read(base))
+elif command == "patch":
+    shutil.copyfile(rest[-1], opt("-o"))
+else:
+    sys.exit(f"unsupported command {command}")
+'''
+
+STUB_APKMD = r'''#!/usr/bin/env python3
+"""Stand-in for `apkmd download` that copies the fixture APK into place"""
+import os, shutil, sys
+from pathlib import Path
+
+args = sys.argv[1:]
+outdir = Path(args[args.index("--outdir") + 1])
+outfile = args[args.index("--outfile") + 1]
+outdir.mkdir(parents=True, exist_ok=True)
+shutil.copyfile(os.environ["BENCH_FIXTURE_APK"], outdir / f"{outfile}.apk")
+'''
+
+STUB_XMLLINT = r'''#!/usr/bin/env python3
+"""Stand-in for `xmllint --noout FILE`"""
+import sys
+from xml.parsers import expat
+
+try:
+    expat.ParserCreate().Parse(open(sys.argv[-1], "rb").read(), True)
+except expat.ExpatError as e:
+    sys.exit(f"{sys.argv[-1]}: {e}")
+'''
+
+def make_decoded_tree(root, dirs, files_per_dir, seed=0):
+    """Decoded tree with qualified res/<group>/<type>-<qualifier>/ directories of XML files"""
+    rng = random.Random(seed)
+    root = Path(root)
+    count = 0
+    for d in range(dirs):
+        res_type = RES_TYPES[d % len(RES_TYPES)]
+        qualifier = DENSITIES[d % len(DENSITIES)]
+        res_dir = root / "res" / f"group{d // len(DENSITIES)}" / f"{res_type}-{qualifier}"
+        res_dir.mkdir(parents=True, exist_ok=True)
+        for i in range(files_per_dir):
+            children = "\n".join(
+                f'    <TextView android:id="@+id/t{rng.randrange(1 << 20)}" android:text="{"x" * rng.randrange(8, 64)}"/>'
+                for _ in range(rng.randrange(2, 12))
+            )
+            (res_dir / f"file_{i}.xml").write_text(XML_TEMPLATE.format(i=i, children=children))
+            count += 1
+    (root / "AndroidManifest.xml").write_text(XML_TEMPLATE.format(i="manifest", children=""))
+    return count + 1
+
+def make_apk(path, abis, libs_per_abi, lib_size, res_dirs=0, files_per_dir=0, seed=0):
+    """Zip APK with lib/<abi>/ libraries, dex files and optionally a res/ tree"""
+    rng = random.Random(seed)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("AndroidManifest.xml", XML_TEMPLATE.format(i="manifest", children=""))
+        zf.writestr("classes.dex", rng.randbytes(lib_size))
+        zf.writestr("resources.arsc", rng.randbytes(lib_size // 4))
+        for abi in abis:
+            for i in range(libs_per_abi):
+                # Half random, half zeros so the entries compress like real libraries
+                zf.writestr(f"lib/{abi}/lib{i}.so", rng.randbytes(lib_size // 2) + bytes(lib_size // 2))
+        if res_dirs:
+            with tempfile.TemporaryDirectory() as tmp:
+                make_decoded_tree(tmp, res_dirs, files_per_dir, seed)
+                for f in sorted(Path(tmp).rglob("*")):
+                    if f.is_file() and f.name != "AndroidManifest.xml":
+                        zf.write(f, f.relative_to(tmp).as_posix())
+    return Path(path)
+
+def make_patches_json(path, patches, packages, versions, fmt="dict", seed=0):
+    """patches.json with compatiblePackages in the dict or list format"""
+    rng = random.Random(seed)
+    package_names = [f"com.example.app{p}" for p in range(packages)]
+    version_names = [f"{19 + v // 50}.{v % 50}.{rng.randrange(40)}" for v in range(versions)]
+    entries = []
+    for i in range(patches):
+        chosen = rng.sample(package_names, k=min(len(package_names), rng.randrange(1, 4)))
+        compatible = {pkg: rng.sample(version_names, k=rng.randrange(1, len(version_names) + 1)) for pkg in chosen}
+        if fmt == "list":
+            compatible = [{"name": pkg, "versions": v} for pkg, v in compatible.items()]
+        entries.append({
+            "name": f"Patch {i}",
+            "description": "x" * rng.randrange(40, 200),
+            "use": True,
+            "compatiblePackages": compatible,
+            "options": [],
+        })
+    Path(path).write_text(json.dumps(entries))
+    return package_names
+
+def install_stubs(bin_dir):
+    """Write the stand-in tools and return the directory to prepend to PATH"""
+    bin_dir = Path(bin_dir)
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    for name, source in (("java", STUB_JAVA), ("apkmd", STUB_APKMD), ("xmllint", STUB_XMLLINT)):
+        stub = bin_dir / name
+        stub.write_text(source.replace("#!/usr/bin/env python3", f"#!{sys.executable}", 1))
+        stub.chmod(0o755)
+    return bin_dir
+
+def timeit(fn, setup=None, repeat=3):
+    """Run fn repeat times (after setup each time) and summarize the wall times"""
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        fn(state) if setup else fn()
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": statistics.median(times), "runs": times}
+
+def run_benchmarks(workdir, scale=1, repeat=3, include_baseline=False):
+    """Generate fixtures under workdir and time every benchmark"""
+    # The scripts resolve configs/ and tool jars relative to the working directory
+    workdir = Path(workdir).resolve()
+    os.chdir(workdir)
+    sys.path.insert(0, str(SCRIPTS_DIR))
+    bin_dir = install_stubs(workdir / "bin")
+    os.environ["PATH"] = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+
+    import downloader
+    import merger
+    import patch_index
+    import pipeline
+    import version_check
+
+    results = {}
+    res_dirs, files_per_dir = 60 * scale, 40
+
+    tree_template = workdir / "tree_template"
+    xml_count = make_decoded_tree(tree_template, res_dirs, files_per_dir)
+
+    def fresh_tree():
+        tree = workdir / "tree"
+        shutil.rmtree(tree, ignore_errors=True)
+        shutil.copytree(tree_template, tree)
+        return tree
+
+    results["filter_dpi_resources"] = timeit(
+        lambda tree: merger.filter_dpi_resources(tree, ["480dpi", "320dpi"]),
+        setup=fresh_tree, repeat=repeat)
+    results["sanitize_xml_files"] = timeit(lambda tree: merger.sanitize_xml_files(tree), setup=fresh_tree, repeat=repeat)
+    results["sanitize_xml_files"]["files"] = xml_count
+    results["validate_xml_files"] = timeit(lambda: merger.validate_xml_files(tree_template), repeat=repeat)
+
+    if include_baseline:
+        # Previous behaviour: one xmllint process per file, one after another
+        def fork_per_file():
+            for xml_file in tree_template.rglob("*.xml"):
+                subprocess.run(["xmllint", "--noout", str(xml_file)], capture_output=True)
+        results["xmllint_fork_per_file"] = timeit(fork_per_file, repeat=1)
+
+    apk = make_apk(workdir / "multi_abi.apk", ABIS, 4 * scale, 256 * 1024)
+    results["strip_native_libs"] = timeit(
+        lambda: merger.strip_native_libs(apk, workdir / "stripped.apk", ABIS[1:]), repeat=repeat)
+
+    for fmt in ("dict", "list"):
+        patches_file = workdir / f"patches_{fmt}.json"
+        packages = make_patches_json(patches_file, 400 * scale, 50, 200, fmt=fmt)
+        content = patches_file.read_text()
+
+        def cold():
+            patch_index._indexes.clear()
+            shutil.rmtree(patch_index.INDEX_DIR, ignore_errors=True)
+            return downloader.process_patches_content(content, packages[0])
+
+        results[f"process_patches_content_{fmt}_cold"] = timeit(cold, repeat=repeat)
+        results[f"process_patches_content_{fmt}_warm"] = timeit(
+            lambda: downloader.process_patches_content(content, packages[0]), repeat=repeat)
+
+        shutil.copyfile(patches_file, workdir / "patches.json")
+        patch_index._file_hashes.clear()
+        results[f"get_compatible_versions_{fmt}"] = timeit(
+            lambda: [version_check.get_compatible_versions(pkg) for pkg in packages], repeat=repeat)
+
+    results["pipeline"] = timeit(lambda: _run_pipeline(workdir, pipeline, scale), repeat=1)
+    return results
+
+def _run_pipeline(workdir, pipeline, scale):
+    """Full download → optimize → patch run against the stand-in tools"""
+    for name in ("downloads", "dist", ".cache/stages", ".cache/pipeline"):
+        shutil.rmtree(workdir / name, ignore_errors=True)
+    (workdir / "configs/apps").mkdir(parents=True, exist_ok=True)
+    (workdir / "configs/build_rules.yaml").write_text(
+        "global:\n  architectures:\n    strip: [x86, x86_64]\n  dpi:\n    keep: [480dpi, 320dpi]\n")
+    (workdir / "configs/apps/bench.yaml").write_text(
+        "package: com.example.bench\nversion: \"1.0\"\nsource:\n  org: example\n  repo: bench\n  type: apk\n"
+        "patches:\n  include: []\n  exclude: []\n")
+    for jar in ("APKEditor.jar", "revanced-cli-all.jar", "patches.rvp", "options.json"):
+        (workdir / jar).write_bytes(b"stub")
+
+    fixture = workdir / "pipeline_fixture.apk"
+    if not fixture.exists():
+        make_apk(fixture, ABIS, 2, 128 * 1024, res_dirs=20 * scale, files_per_dir=20)
+    os.environ["BENCH_FIXTURE_APK"] = str(fixture)
+
+    scheduler = pipeline.Scheduler(resume=False)
+    pipeline.add_app(scheduler, "bench")
+    _, failed = scheduler.run()
+    if failed:
+        raise RuntimeError(f"Pipeline benchmark failed: {sorted(failed)}")
+
+def compare(results, baseline):
+    """Print median time ratios against a previous results file"""
+    print(f"{'benchmark':<40} {'baseline':>10} {'current':>10} {'ratio':>8}")
+    for name, result in results["benchmarks"].items():
+        previous = baseline["benchmarks"].get(name)
+        if not previous:
+            print(f"{name:<40} {'-':>10} {result['median']:>10.4f} {'new':>8}")
+            continue
+        ratio = result["median"] / previous["median"] if previous["median"] else float("inf")
+        print(f"{name:<40} {previous['median']:>10.4f} {result['median']:>10.4f} {ratio:>7.2f}x")
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPTS_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the hot paths offline against synthetic fixtures")
+    parser.add_argument("--scale", type=int, default=1, help="Fixture size multiplier")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the results")
+    parser.add_argument("--compare", help="Previous results file to compare against")
+    parser.add_argument("--include-baseline", action="store_true",
+                        help="Also time the old fork-per-file xmllint validation")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated fixtures")
+    args = parser.parse_args()
+
+    output = Path(args.output).resolve()
+    baseline_file = Path(args.compare).resolve() if args.compare else None
+    workdir = Path(tempfile.mkdtemp(prefix="autorevanced_bench_"))
+    try:
+        benchmarks = run_benchmarks(workdir, args.scale, args.repeat, args.include_baseline)
+    finally:
+        os.chdir(SCRIPTS_DIR.parent)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "scale": args.scale,
+        "benchmarks": benchmarks,
+    }
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {output}")
+
+    if baseline_file:
+        with open(baseline_file) as f:
+            compare(results, json.load(f))
+    else:
+        for name, result in benchmarks.items():
+            print(f"{name:<40} {result['median']:>10.4f}s")
@@ -0,0 +1,294 @@
+"""Typed, validated configuration shared by every script.
+
+build_rules.yaml and configs/apps/*.yaml are parsed into slotted dataclasses
+with defaults. Each file is parsed once per process and cached by mtime and
+size, so repeated lookups only cost a stat(). Schema problems are collected
+rather than raised one at a time: validate() reports every error in every
+file in one pass, before any stage starts.
+"""
+import argparse
+import dataclasses
+import sys
+import threading
+import types
+import typing
+from dataclasses import dataclass, field
+from pathlib import Path
+import yaml
+
+CONFIG_DIR = Path("configs")
+BUILD_RULES_FILE = CONFIG_DIR / "build_rules.yaml"
+APPS_DIR = CONFIG_DIR / "apps"
+ALL_ARCHITECTURES = ["armeabi-v7a", "arm64-v8a", "x86", "x86_64"]
+SOURCE_TYPES = ["apk", "bundle", "split"]
+UNPINNED_VERSIONS = {"stable", "latest", "beta", "alpha", "any", ""}  # Channels, not releases
+
+def is_pinned(version) -> bool:
+    """Whether a version names one release rather than a channel such as latest"""
+    return version is not None and str(version).strip().lower() not in UNPINNED_VERSIONS
+
+class ConfigError(RuntimeError):
+    """One or more schema errors; errors holds every message"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        super().__init__("Invalid configuration:\n  " + "\n  ".join(self.errors))
+
+@dataclass(slots=True)
+class Architectures:
+    strip: list[str] = field(default_factory=list)
+    keep: list[str] = field(default_factory=list)
+
+@dataclass(slots=True)
+class Dpi:
+    keep: list[str] = field(default_factory=list)
+
+@dataclass(slots=True)
+class BuildRules:
+    output_dir: str = "./dist"
+    retention_days: int = 7
+    retention_max_mb: int = 4096
+    temp_max_age_hours: int = 6
+    architectures: Architectures = field(default_factory=Architectures)
+    dpi: Dpi = field(default_factory=Dpi)
+    version_check_interval: int = 86400
+    timeouts: dict[str, int] = field(default_factory=dict)
+
+@dataclass(slots=True)
+class Source:
+    org: str | None = None
+    repo: str | None = None
+    type: str = "apk"
+    url: str | None = None
+    sha256: str | None = None
+    size: int | None = None
+    connections: int = 4
+
+@dataclass(slots=True)
+class Patches:
+    source: str | None = None
+    include: list[str] = field(default_factory=list)
+    exclude: list[str] = field(default_factory=list)
+    fetch_latest_compatible: bool = field(default=False, metadata={"key": "fetchLatestCompatibleVersion"})
+
+@dataclass(slots=True)
+class Variant:
+    arch: str
+    name: str | None = None  # Defaults to arch
+    dpi: list[str] | None = None  # Defaults to the global dpi.keep
+
+@dataclass(slots=True)
+class AppConfig:
+    package: str
+    name: str | None = None
+    version: str = "stable"
+    min_android_version: int = 21
+    source: Source = field(default_factory=Source)
+    patches: Patches = field(default_factory=Patches)
+    arch: str | list[str] = "universal"
+    variants: list[Variant] = field(default_factory=list)
+
+# path -> (mtime_ns, size, parsed object, errors)
+_cache = {}
+_cache_lock = threading.Lock()
+
+def load_build_rules(path=BUILD_RULES_FILE) -> BuildRules:
+    """The global build rules, raising ConfigError if they are invalid"""
+    rules, errors = _load(path, _parse_build_rules)
+    if errors:
+        raise ConfigError(errors)
+    return rules
+
+def load_app(app_name) -> AppConfig:
+    """An app's config from configs/apps/<app_name>.yaml, raising ConfigError if invalid"""
+    app, errors = _load(APPS_DIR / f"{app_name}.yaml", _parse_app)
+    if errors:
+        raise ConfigError(errors)
+    return app
+
+def app_names() -> list:
+    return [p.stem for p in sorted(APPS_DIR.glob("*.yaml"))]
+
+def load_apps(names=None) -> dict:
+    """{app name: AppConfig} for the given apps (default: all), validated together"""
+    names = app_names() if names is None else names
+    errors = validate(names, include_rules=False)
+    if errors:
+        raise ConfigError(errors)
+    return {name: load_app(name) for name in names}
+
+def validate(names=None, include_rules=True) -> list:
+    """Every schema error in build_rules.yaml and the given app configs"""
+    errors = []
+    if include_rules:
+        errors.extend(_load(BUILD_RULES_FILE, _parse_build_rules)[1])
+    for name in app_names() if names is None else names:
+        errors.extend(_load(APPS_DIR / f"{name}.yaml", _parse_app)[1])
+    return errors
+
+def get_value(obj, dotted):
+    """Look up a dotted YAML key path (e.g. source.type) on a parsed config"""
+    for key in dotted.split("."):
+        names = {f.metadata.get("key", f.name): f.name for f in dataclasses.fields(obj)}
+        if key not in names:
+            raise KeyError(dotted)
+        obj = getattr(obj, names[key])
+    return obj
+
+def _load(path, parse):
+    path = Path(path)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None, [f"{path}: file not found"]
+
+    with _cache_lock:
+        cached = _cache.get(str(path))
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2], cached[3]
+
+    errors = []
+    try:
+        with open(path) as f:
+            data = yaml.safe_load(f)
+    except yaml.YAMLError as e:
+        data = None
+        errors.append(f"{path}: invalid YAML: {e}")
+    result = parse(data or {}, str(path), errors) if not errors else None
+
+    with _cache_lock:
+        _cache[str(path)] = (stat.st_mtime_ns, stat.st_size, result, errors)
+    return result, errors
+
+def _parse_build_rules(data, where, errors):
+    if "global" not in data:
+        errors.append(f"{where}: missing 'global' section")
+    rules = _convert(data.get("global") or {}, BuildRules, f"{where}: global", errors)
+
+    for arch in rules.architectures.strip:
+        if arch not in ALL_ARCHITECTURES:
+            errors.append(f"{where}: global.architectures.strip: unknown architecture '{arch}'")
+    if set(ALL_ARCHITECTURES) <= set(rules.architectures.strip):
+        errors.append(f"{where}: global.architectures.strip removes every architecture, leaving no native libraries")
+    for dpi in rules.dpi.keep:
+        if not str(dpi).endswith("dpi"):
+            errors.append(f"{where}: global.dpi.keep: '{dpi}' is not a density qualifier")
+    for stage, seconds in rules.timeouts.items():
+        if isinstance(seconds, int) and seconds <= 0:
+            errors.append(f"{where}: global.timeouts.{stage}: must be positive")
+    return rules
+
+def _parse_app(data, where, errors):
+    app = _convert(data, AppConfig, f"{where}:", errors)
+
+    source = app.source
+    if not source.url and not (source.org and source.repo):
+        errors.append(f"{where}: source: needs either url or both org and repo")
+    if source.type not in SOURCE_TYPES:
+        errors.append(f"{where}: source.type: must be one of {', '.join(SOURCE_TYPES)}")
+
+    archs = app.arch if isinstance(app.arch, list) else [app.arch]
+    for arch in archs:
+        if arch is not None and arch != "universal" and arch not in ALL_ARCHITECTURES:
+            errors.append(f"{where}: arch: unknown architecture '{arch}'")
+    for variant in app.variants:
+        if variant.arch is not None and variant.arch not in ALL_ARCHITECTURES:
+            errors.append(f"{where}: variants: unknown architecture '{variant.arch}'")
+        variant.name = variant.name or variant.arch
+    names = [variant.name for variant in app.variants]
+    if len(set(names)) != len(names):
+        errors.append(f"{where}: variants: names must be unique")
+    return app
+
+def _convert(value, tp, where, errors):
+    """Check value against a type annotation, building dataclasses; errors are collected"""
+    if dataclasses.is_dataclass(tp):
+        if not isinstance(value, dict):
+            errors.append(f"{where}: expected a mapping, got {type(value).__name__}")
+            value = {}
+        fields = {f.metadata.get("key", f.name): f for f in dataclasses.fields(tp)}
+        for key in value:
+            if key not in fields:
+                errors.append(f"{where}: unknown key '{key}'")
+        hints = typing.get_type_hints(tp)
+        kwargs = {}
+        for key, f in fields.items():
+            required = f.default is dataclasses.MISSING and f.default_factory is dataclasses.MISSING
+            if value.get(key) is None:
+                if required:
+                    errors.append(f"{where}: missing required key '{key}'")
+                    kwargs[f.name] = None
+                continue
+            kwargs[f.name] = _convert(value[key], hints[f.name], _join(where, key), errors)
+        return tp(**kwargs)
+
+    origin = typing.get_origin(tp)
+    if origin in (types.UnionType, typing.Union):
+        for option in typing.get_args(tp):
+            option_errors = []
+            result = _convert(value, option, where, option_errors)
+            if not option_errors:
+                return result
+        errors.append(f"{where}: expected {_describe(tp)}, got {type(value).__name__}")
+        return None
+    if origin is list:
+        if not isinstance(value, list):
+            errors.append(f"{where}: expected a list, got {type(value).__name__}")
+            return []
+        (item,) = typing.get_args(tp)
+        return [_convert(v, item, f"{where}[{i}]", errors) for i, v in enumerate(value)]
+    if origin is dict:
+        if not isinstance(value, dict):
+            errors.append(f"{where}: expected a mapping, got {type(value).__name__}")
+            return {}
+        _, item = typing.get_args(tp)
+        return {str(k): _convert(v, item, _join(where, k), errors) for k, v in value.items()}
+
+    if tp is type(None):
+        ok = value is None
+    elif tp is int:
+        ok = isinstance(value, int) and not isinstance(value, bool)
+    else:
+        ok = isinstance(value, tp)
+    if not ok:
+        hint = " (quote version numbers)" if tp is str and isinstance(value, (int, float)) else ""
+        errors.append(f"{where}: expected {_describe(tp)}, got {type(value).__name__}{hint}")
+        return None
+    return value
+
+def _join(where, key):
+    return f"{where} {key}" if where.endswith(":") else f"{where}.{key}"
+
+def _describe(tp):
+    if typing.get_origin(tp) in (types.UnionType, typing.Union):
+        return " or ".join(_describe(t) for t in typing.get_args(tp) if t is not type(None))
+    if typing.get_origin(tp) is list:
+        return "a list"
+    return getattr(tp, "__name__", str(tp))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate configs or print a config value")
+    parser.add_argument("--app", action="append", help="App identifier (repeatable; default: all apps)")
+    parser.add_argument("--get", metavar="KEY", help="Print a dotted key from the app config (with one --app) or build rules")
+    args = parser.parse_args()
+
+    errors = validate(args.app)
+    if errors:
+        print("Invalid configuration:", file=sys.stderr)
+        for error in errors:
+            print(f"  {error}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.get:
+        if args.app and len(args.app) > 1:
+            parser.error("--get takes a single --app")
+        target = load_app(args.app[0]) if args.app else load_build_rules()
+        try:
+            value = get_value(target, args.get)
+        except KeyError:
+            parser.error(f"Unknown key: {args.get}")
+        print(value if not isinstance(value, (list, dict)) else yaml.safe_dump(value, default_flow_style=True).strip())
+    else:
+        for name in args.app or app_names():
+            print(f"{name}:")
+            print(yaml.safe_dump(dataclasses.asdict(load_app(name)), sort_keys=False))
@@ -0,0 +1,237 @@
+"""Zip-entry-level binary deltas between consecutive releases of an APK.
+
+The previous patched APK of every app and variant is kept in .cache/releases.
+A delta describes the new APK as a sequence of COPY ranges from the previous
+one and literal DATA: the compressed data of every entry whose name, CRC and
+sizes are unchanged is referenced rather than re-sent. Local headers are
+small and shift with alignment padding and timestamps, so they travel as
+DATA along with changed entries, the signing block and the central
+directory. The op stream is xz-compressed and carries the SHA-256 of both
+files, so apply() either reconstructs the exact target APK or fails.
+"""
+import argparse
+import hashlib
+import json
+import lzma
+import os
+import shutil
+import struct
+import sys
+import zipfile
+from datetime import datetime, UTC
+from pathlib import Path
+import ziputil
+
+RELEASES_DIR = Path(".cache/releases")
+MAGIC = b"APKDLT01"
+HEADER = struct.Struct("<8s32s32sQ")  # magic, source sha256, target sha256, target size
+COPY = struct.Struct("<cQQ")  # b"C", source offset, length
+DATA = struct.Struct("<cQ")  # b"D", length, then the bytes
+CHUNK = 1 << 20
+
+class DeltaError(RuntimeError):
+    """A delta that does not match its source or does not reproduce its target"""
+
+def plan_ops(source_path, target_path) -> list:
+    """("C", source offset, length) and ("D", target offset, length) ops covering the target"""
+    with zipfile.ZipFile(source_path) as zf:
+        candidates = {}
+        for entry in ziputil.read_entries(zf):
+            info = entry.info
+            key = (entry.name, info.CRC, info.compress_size, info.file_size, entry.compress_type)
+            candidates[key] = entry.data_offset
+
+    ops = []
+    with open(source_path, "rb") as src, zipfile.ZipFile(target_path) as zf:
+        tgt = zf.fp
+        position = 0
+        for entry in sorted(ziputil.read_entries(zf), key=lambda e: e.info.header_offset):
+            info = entry.info
+            source_offset = candidates.get((entry.name, info.CRC, info.compress_size, info.file_size, entry.compress_type))
+            if source_offset is None or not info.compress_size:
+                continue
+            start = entry.data_offset
+            if not _same_bytes(src, source_offset, tgt, start, info.compress_size):
+                continue
+            if start > position:
+                ops.append(("D", position, start - position))
+            _append_copy(ops, source_offset, info.compress_size)
+            position = start + info.compress_size
+        tgt.seek(0, os.SEEK_END)
+        size = tgt.tell()
+    if size > position:
+        ops.append(("D", position, size - position))
+    return ops
+
+def create(source_path, target_path, delta_path):
+    """Write a delta that turns source_path into target_path; returns the op list"""
+    ops = plan_ops(source_path, target_path)
+    header = HEADER.pack(MAGIC, _digest(source_path), _digest(target_path), Path(target_path).stat().st_size)
+
+    delta_path = Path(delta_path)
+    tmp_file = delta_path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        with open(target_path, "rb") as tgt, open(tmp_file, "wb") as raw:
+            raw.write(header)
+            with lzma.open(raw, "wb", preset=6) as out:
+                for kind, offset, length in ops:
+                    if kind == "C":
+                        out.write(COPY.pack(b"C", offset, length))
+                        continue
+                    out.write(DATA.pack(b"D", length))
+                    tgt.seek(offset)
+                    _stream(tgt, out, length)
+        os.replace(tmp_file, delta_path)
+    finally:
+        Path(tmp_file).unlink(missing_ok=True)
+    return ops
+
+def apply(source_path, delta_path, output_path=None):
+    """Rebuild the target from source_path and a delta, verifying both digests.
+
+    With output_path None the target is only reconstructed in memory-bounded
+    chunks and checked. Returns the target's SHA-256 hex digest.
+    """
+    with open(delta_path, "rb") as raw:
+        magic, source_sha, target_sha, target_size = HEADER.unpack(raw.read(HEADER.size))
+        if magic != MAGIC:
+            raise DeltaError(f"{delta_path} is not an APK delta")
+        if _digest(source_path) != source_sha:
+            raise DeltaError(f"{source_path} is not the release {delta_path} was made against")
+
+        output_path = Path(output_path) if output_path else None
+        tmp_file = output_path.with_suffix(f".{os.getpid()}.tmp") if output_path else None
+        digest = hashlib.sha256()
+        written = 0
+        try:
+            with open(source_path, "rb") as src, lzma.open(raw, "rb") as ops, \
+                    (open(tmp_file, "wb") if tmp_file else _NullWriter()) as out:
+                while kind := ops.read(1):
+                    if kind == b"C":
+                        offset, length = COPY.unpack(kind + ops.read(COPY.size - 1))[1:]
+                        src.seek(offset)
+                        reader = src
+                    elif kind == b"D":
+                        (length,) = DATA.unpack(kind + ops.read(DATA.size - 1))[1:]
+                        reader = ops
+                    else:
+                        raise DeltaError(f"Corrupt op {kind!r} in {delta_path}")
+                    written += _stream(reader, out, length, digest)
+            if written != target_size or digest.digest() != target_sha:
+                raise DeltaError(f"Applying {delta_path} did not reproduce the target APK")
+            if tmp_file:
+                os.replace(tmp_file, output_path)
+        except (lzma.LZMAError, struct.error, EOFError) as e:
+            raise DeltaError(f"Corrupt delta {delta_path}: {e}") from e
+        finally:
+            if tmp_file:
+                tmp_file.unlink(missing_ok=True)
+    return digest.hexdigest()
+
+def release_path(app_name, variant=None):
+    return RELEASES_DIR / app_name / f"{variant or 'universal'}.apk"
+
+def release(app_name, apk, variant=None):
+    """Make a delta from the previous release of app_name/variant to apk, then keep apk as the release.
+
+    Returns the delta path, or None on the first release or when apk is unchanged.
+    """
+    apk = Path(apk)
+    previous = release_path(app_name, variant)
+    delta_path = None
+    if previous.exists():
+        source_sha = _digest(previous)
+        if source_sha == _digest(apk):
+            return None
+        delta_path = apk.with_name(f"{apk.stem}.{source_sha.hex()[:12]}.apkdelta")
+        create(previous, apk, delta_path)
+        apply(previous, delta_path)  # Never ship a delta that doesn't round-trip
+        ratio = delta_path.stat().st_size / apk.stat().st_size
+        print(f"Delta {delta_path.name}: {delta_path.stat().st_size} bytes ({ratio:.1%} of {apk.name})")
+
+    previous.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = previous.with_suffix(f".{os.getpid()}.tmp")
+    shutil.copyfile(apk, tmp_file)
+    os.replace(tmp_file, previous)
+    with open(previous.with_suffix(".json"), "w") as f:
+        json.dump({"source": str(apk), "sha256": _digest(previous).hex(),
+                   "released": datetime.now(UTC).isoformat()}, f, indent=2)
+    return delta_path
+
+def _append_copy(ops, offset, length):
+    if ops and ops[-1][0] == "C" and ops[-1][1] + ops[-1][2] == offset:
+        ops[-1] = ("C", ops[-1][1], ops[-1][2] + length)
+    else:
+        ops.append(("C", offset, length))
+
+def _same_bytes(a, a_offset, b, b_offset, length):
+    a.seek(a_offset)
+    b.seek(b_offset)
+    while length:
+        n = min(length, CHUNK)
+        if a.read(n) != b.read(n):
+            return False
+        length -= n
+    return True
+
+def _stream(src, dst, length, digest=None):
+    remaining = length
+    while remaining:
+        chunk = src.read(min(remaining, CHUNK))
+        if not chunk:
+            raise DeltaError("Unexpected end of input")
+        dst.write(chunk)
+        if digest:
+            digest.update(chunk)
+        remaining -= len(chunk)
+    return length
+
+def _digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+class _NullWriter:
+    def write(self, data):
+        return len(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create or apply zip-entry-level APK deltas")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("create", help="Delta from SOURCE to TARGET")
+    p.add_argument("source")
+    p.add_argument("target")
+    p.add_argument("delta")
+    p = sub.add_parser("apply", help="Rebuild the target from SOURCE and DELTA")
+    p.add_argument("source")
+    p.add_argument("delta")
+    p.add_argument("output", nargs="?", help="Output APK (omit to only verify)")
+    p = sub.add_parser("release", help="Delta against the kept release, then keep APK as the new release")
+    p.add_argument("--app", required=True, help="App identifier")
+    p.add_argument("--variant", help="Variant name")
+    p.add_argument("apk")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "create":
+            ops = create(args.source, args.target, args.delta)
+            copied = sum(length for kind, _, length in ops if kind == "C")
+            print(f"{args.delta}: {Path(args.delta).stat().st_size} bytes, "
+                  f"{copied} of {Path(args.target).stat().st_size} target bytes copied from source")
+        elif args.command == "apply":
+            digest = apply(args.source, args.delta, args.output)
+            print(f"{args.output or 'Target'} verified: sha256 {digest}")
+        else:
+            delta_path = release(args.app, args.apk, args.variant)
+            print(delta_path or f"No delta for {args.apk} (first release or unchanged)")
+    except (DeltaError, OSError, zipfile.BadZipFile) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,48 @@
+"""Screen density qualifiers and the dpi.keep rule.
+
+Split selection (splits.py), resource filtering (merger.py) and size
+projections (apk_size.py) all decide what to drop with keeps_density(), so
+dpi.keep entries may be buckets (xxhdpi) or values (480dpi) everywhere.
+Resource filtering and its projection also share the path rule.
+"""
+
+DENSITY_BUCKETS = {"ldpi": 120, "mdpi": 160, "tvdpi": 213, "hdpi": 240,
+                   "xhdpi": 320, "xxhdpi": 480, "xxxhdpi": 640}
+
+def density_qualifier(dir_name):
+    """Return the DPI qualifier of a resource directory name (e.g. drawable-xxhdpi), or None"""
+    dir_parts = dir_name.split('-')
+    for part in dir_parts[1:]:
+        if part.endswith('dpi'):
+            return part
+    return None
+
+def density_value(qualifier):
+    """The dpi of a density qualifier (xxhdpi or 480dpi → 480), or None for nodpi, anydpi and the like"""
+    if qualifier in DENSITY_BUCKETS:
+        return DENSITY_BUCKETS[qualifier]
+    number = qualifier.removesuffix('dpi')
+    return int(number) if number.isdigit() else None
+
+def keeps_density(qualifier, keep_dpis):
+    """Whether dpi.keep keeps a density qualifier or split.
+
+    An empty keep list and density-independent qualifiers are always kept.
+    """
+    value = density_value(qualifier)
+    if not keep_dpis or value is None:
+        return True
+    return any(density_value(dpi) == value for dpi in keep_dpis)
+
+def is_filtered_dpi_dir(dir_name, keep_dpis):
+    """Whether a resource directory name carries a density that dpi.keep drops"""
+    qualifier = density_qualifier(dir_name)
+    return qualifier is not None and not keeps_density(qualifier, keep_dpis)
+
+def is_filtered_res_path(parts, keep_dpis):
+    """Whether resource filtering removes a path, given as its parts relative to the decoded root.
+
+    filter_dpi_resources only drops res/<group>/<dir> directories (and what is
+    below them); apk_size projects its savings with the same rule.
+    """
+    return len(parts) >= 3 and parts[0] == "res" and is_filtered_dpi_dir(parts[2], keep_dpis)
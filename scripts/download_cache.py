@@ -0,0 +1,153 @@
+"""Persistent cache of upstream APK downloads.
+
+Downloads are keyed by where they came from: org, repo (or direct URL),
+resolved version, arch and type. Files are stored once under
+.cache/downloads/objects by their SHA-256 and entries/<key>.json lists the
+files a download produced. A hit is re-verified against the recorded digest
+and materialized into downloads/ by reflink or hardlink, so a version that
+has not changed upstream is never fetched twice.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+import config
+import stage_cache
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path(".cache/downloads")
+MAX_CACHE_BYTES = 6 * 1024 * 1024 * 1024
+FICLONE = 0x40049409  # linux/fs.h
+
+def cache_key(source, version: str, arch: str) -> str | None:
+    """Key for a download, or None if the version does not name a fixed release"""
+    if not config.is_pinned(version):
+        return None
+    material = {
+        "org": source.org,
+        "repo": source.repo,
+        "url": source.url,
+        "version": str(version),
+        "arch": arch,
+        "type": source.type,
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode()).hexdigest()
+
+def lookup(key, dest_dir, package) -> list | None:
+    """Materialize a cached download into dest_dir, returning its files or None on a miss"""
+    entry = _read_entry(key)
+    if entry is None:
+        return None
+
+    objects = []
+    for item in entry["files"]:
+        object_file = _object_path(item["sha256"])
+        try:
+            if object_file.stat().st_size != item["size"]:
+                raise FileNotFoundError(object_file)
+        except FileNotFoundError:
+            logger.info(f"Download cache entry {key[:12]} is incomplete, discarding it")
+            _entry_path(key).unlink(missing_ok=True)
+            return None
+        if _sha256(object_file) != item["sha256"]:
+            logger.warning(f"Cached object {object_file.name} is corrupt, discarding it")
+            object_file.unlink(missing_ok=True)
+            _entry_path(key).unlink(missing_ok=True)
+            return None
+        objects.append((object_file, item))
+
+    files = []
+    for object_file, item in objects:
+        os.utime(object_file)  # Mark as recently used for eviction
+        target = Path(dest_dir) / f"{package}{item['suffix']}"
+        _materialize(object_file, target)
+        files.append(target)
+    return files
+
+def store(key, files, package):
+    """Add downloaded files to the cache under key"""
+    items = []
+    for path in map(Path, files):
+        digest = stage_cache.file_digest(path)
+        object_file = _object_path(digest)
+        if not object_file.exists():
+            object_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = object_file.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            shutil.copyfile(path, tmp_file)
+            if _sha256(tmp_file) != digest:
+                tmp_file.unlink(missing_ok=True)
+                raise RuntimeError(f"{path} changed while it was being cached")
+            os.replace(tmp_file, object_file)
+        items.append({
+            "suffix": path.name[len(package):],
+            "sha256": digest,
+            "size": object_file.stat().st_size,
+        })
+
+    entry_file = _entry_path(key)
+    entry_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = entry_file.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_file, "w") as f:
+        json.dump({"files": items}, f, indent=2)
+    os.replace(tmp_file, entry_file)
+    evict()
+
+def evict(max_bytes=MAX_CACHE_BYTES):
+    """Drop least recently used objects until the cache fits in max_bytes"""
+    objects = []
+    for object_file in (CACHE_DIR / "objects").glob("*/*"):
+        if object_file.suffix == ".tmp":
+            continue
+        try:
+            stat = object_file.stat()
+        except FileNotFoundError:
+            continue
+        objects.append((stat.st_mtime, stat.st_size, object_file))
+
+    total = sum(size for _, size, _ in objects)
+    for _, size, object_file in sorted(objects):
+        if total <= max_bytes:
+            break
+        object_file.unlink(missing_ok=True)
+        total -= size
+    # Entries whose objects were evicted are dropped lazily by lookup()
+
+def _read_entry(key):
+    try:
+        with open(_entry_path(key)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _entry_path(key):
+    return CACHE_DIR / "entries" / f"{key}.json"
+
+def _object_path(digest):
+    return CACHE_DIR / "objects" / digest[:2] / digest
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _materialize(object_file, target):
+    """Reflink the object into place, then try a hardlink, then a plain copy"""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    target.unlink(missing_ok=True)
+    try:
+        with open(object_file, "rb") as src, open(target, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return
+    except OSError:
+        target.unlink(missing_ok=True)
+    try:
+        os.link(object_file, target)
+    except OSError:
+        shutil.copyfile(object_file, target)
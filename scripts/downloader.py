@@ -1,68 +1,78 @@
-import yaml
 import json
+import re
 from pathlib import Path
-import subprocess
 import argparse
 import sys
 import logging
-from natsort import natsorted
-import requests
+import http_cache
+import patch_index
+import runner
+import fetch
+import download_cache
+import config
+from urllib.parse import urlsplit
+
+APK_SUFFIXES = ['.apk', '.apks', '.xapk', '.apkm']
+PARTIAL_SUFFIXES = ('.part', '.part.json')
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-def load_config(app_name: str) -> dict:
-    config_path = Path("configs/apps") / f"{app_name}.yaml"
-    logger.debug(f"Loading config from {config_path}")
-    try:
-        with open(config_path) as f:
-            config = yaml.safe_load(f)
-            logger.debug(f"Loaded config: {json.dumps(config, indent=2)}")
-            return config
-    except FileNotFoundError:
-        raise RuntimeError(f"Config file not found: {config_path}")
-    except yaml.YAMLError as e:
-        raise RuntimeError(f"Invalid YAML in config: {e}")
-
-def generate_apkmd_config(app_config: dict) -> dict:
+def load_config(app_name: str) -> config.AppConfig:
+    logger.debug(f"Loading config for {app_name}")
+    app_config = config.load_app(app_name)
+    logger.debug(f"Loaded config: {app_config}")
+    return app_config
+
+def generate_apkmd_config(app_config: config.AppConfig) -> dict:
     logger.debug("Generating apkmd config")
-    try:
-        # Get architecture, defaulting to 'universal' if not specified
-        arch = app_config.get('arch', 'universal')
-        if isinstance(arch, list):
-            arch = arch[0]  # Take first architecture if multiple are specified
-        
-        config = {
-            "options": {
-                "arch": arch,
-                "outDir": "downloads",
-                "type": app_config['source'].get('type', 'apk'),
-                "minandroidversion": app_config.get('min_android_version', 21)
-            },
-            "apps": [{
-                "org": app_config['source']['org'],
-                "repo": app_config['source']['repo'],
-                "version": app_config.get('version', 'stable'),
-                "outFile": app_config.get('package', app_config['source']['repo'])
-            }]
-        }
-        logger.debug(f"Generated apkmd config: {json.dumps(config, indent=2)}")
-        return config
-    except KeyError as e:
-        raise RuntimeError(f"Missing required config key: {e}")
+    apkmd_config = {
+        "options": {
+            "arch": get_download_arch(app_config),
+            "outDir": "downloads",
+            "type": app_config.source.type,
+            "minandroidversion": app_config.min_android_version
+        },
+        "apps": [{
+            "org": app_config.source.org,
+            "repo": app_config.source.repo,
+            "version": app_config.version,
+            "outFile": app_config.package
+        }]
+    }
+    logger.debug(f"Generated apkmd config: {json.dumps(apkmd_config, indent=2)}")
+    return apkmd_config
+
+def get_variants(app_config: config.AppConfig) -> list:
+    """Per-ABI build variants, from an explicit variants list or an arch list.
+
+    Each variant is a config.Variant with a name, the arch to keep and
+    optionally its own dpi keep list. A single arch means no variants.
+    """
+    if app_config.variants:
+        return app_config.variants
+    arch = app_config.arch
+    if isinstance(arch, list) and len(arch) > 1:
+        return [config.Variant(arch=a, name=a) for a in arch]
+    return []
+
+def get_download_arch(app_config: config.AppConfig) -> str:
+    """Architecture to download; multi-variant apps fetch the universal artifact once"""
+    if get_variants(app_config):
+        return 'universal'
+    arch = app_config.arch
+    if isinstance(arch, list):
+        arch = arch[0] if arch else 'universal'
+    return arch
 
 def get_compatible_versions(app_package: str) -> list:
     """Get all compatible versions from any patch for a package"""
     try:
-        # Try all possible patches.json filenames
-        for fn in ["patches.json", "patches.json.1", "patches.json.2"]:
-            patches_file = Path(fn)
-            if patches_file.exists():
-                with open(patches_file) as f:
-                    content = f.read().strip()
-                    if content:
-                        return process_patches_content(content, app_package)
+        # Try all possible patches.json filenames through the shared index
+        index = patch_index.load_local_index()
+        if index is not None:
+            return patch_index.get_versions(index, app_package)
         
         logger.error("No valid patches.json found locally, trying remote...")
         return get_remote_compatible_versions(app_package)
@@ -74,33 +84,10 @@ def get_compatible_versions(app_package: str) -> list:
 def process_patches_content(content: str, app_package: str) -> list:
     """Process patches.json content"""
     try:
-        patches = json.loads(content)
-        all_versions = set()
-        
-        for patch in patches:
-            # Handle different patch format versions
-            compatible_packages = patch.get("compatiblePackages", [])
-            if not compatible_packages:
-                continue
-                
-            # In patches.json, compatiblePackages can be a dict or list
-            if isinstance(compatible_packages, dict):
-                # Handle dict format where app_package is a key
-                versions = compatible_packages.get(app_package, [])
-                if isinstance(versions, list):
-                    all_versions.update(versions)
-            else:
-                # Handle list format where each item has name and versions
-                for pkg in compatible_packages:
-                    if isinstance(pkg, dict) and pkg.get("name") == app_package:
-                        versions = pkg.get("versions", [])
-                        if isinstance(versions, list):
-                            all_versions.update(versions)
-        
-        return natsorted(all_versions) if all_versions else []
-    except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON in patches file: {str(e)}")
-        return []
+        index = patch_index.load_index(content)
+        if index is None:
+            return []
+        return patch_index.get_versions(index, app_package)
     except Exception as e:
         logger.error(f"Error processing patches content: {str(e)}")
         return []
@@ -109,32 +96,90 @@ def get_remote_compatible_versions(app_package: str) -> list:
     """Fallback to downloading patches.json directly"""
     try:
         patches_url = "https://github.com/anddea/revanced-patches/releases/latest/download/patches.json"
-        response = requests.get(patches_url)
+        response = http_cache.cached_get(patches_url)
         response.raise_for_status()
-        return process_patches_content(response.text, app_package)
+        return process_patches_content(response.content, app_package)
     except Exception as e:
         logger.error(f"Remote fetch failed: {str(e)}")
         return []
 
-def download_apk(app_name: str, debug: bool = False):
-    logger.info(f"Starting download for {app_name}")
-    config = load_config(app_name)
-    
+def resolve_version(app_config: config.AppConfig) -> str:
+    """Version to download: latest patch-compatible one, or the configured version"""
     # Check if we should use patch-compatible version
-    if 'patches' in config and config['patches'].get('fetchLatestCompatibleVersion', False):
-        compatible_versions = get_compatible_versions(config['package'])
+    if app_config.patches.fetch_latest_compatible:
+        compatible_versions = get_compatible_versions(app_config.package)
         if not compatible_versions:
-            raise RuntimeError(f"No patch-compatible versions found for {config['package']}")
+            raise RuntimeError(f"No patch-compatible versions found for {app_config.package}")
         version = compatible_versions[-1]  # Get latest compatible version
         logger.info(f"Using patch-compatible version: {version}")
     else:
-        # Use version from config, defaulting to 'stable'
-        version = config.get('version', 'stable')
+        version = app_config.version
         logger.info(f"Using configured version: {version}")
+    return version
+
+def download_direct(app_config: config.AppConfig, version: str) -> list:
+    """Download source.url with the native resumable engine and verify it"""
+    source = app_config.source
+    url = source.url.format(version=version)
+    suffix = Path(urlsplit(url).path).suffix.lower()
+    if suffix not in APK_SUFFIXES:
+        suffix = '.apk' if source.type == 'apk' else '.apks'
     
-    # Existing download logic
-    org = config['source']['org']
-    repo = config['source']['repo']
+    dest = Path("downloads") / f"{app_config.package}{suffix}"
+    fetch.fetch(
+        url,
+        dest,
+        connections=source.connections,
+        sha256=source.sha256,
+        size=source.size,
+    )
+    return [dest]
+
+def download_apk(app_name: str, debug: bool = False):
+    logger.info(f"Starting download for {app_name}")
+    app_config = load_config(app_name)
+    version = resolve_version(app_config)
+    arch = get_download_arch(app_config)
+    
+    # Earlier runs leave their files behind; never let them be picked up as this download
+    clear_downloads(app_config.package)
+    
+    key = download_cache.cache_key(app_config.source, version, arch)
+    if key:
+        cached = download_cache.lookup(key, "downloads", app_config.package)
+        if cached:
+            logger.info(f"Using cached download: {[apk.name for apk in cached]}")
+            return cached
+    
+    if app_config.source.url:
+        apks = download_direct(app_config, version)
+    else:
+        apks = download_apkmd(app_config, version, arch, debug)
+    
+    if key:
+        download_cache.store(key, apks, app_config.package)
+    logger.info(f"Successfully downloaded: {[apk.name for apk in apks]}")
+    return apks
+
+def is_package_file(name: str, package: str) -> bool:
+    """Whether a file name is <package>[_<qualifier>]<APK suffix>[.part[.json]]"""
+    # Not a prefix match: com.google.android.youtube.music files are another package's
+    if not name.startswith(package):
+        return False
+    suffixes = '|'.join(re.escape(suffix) for suffix in APK_SUFFIXES)
+    return re.fullmatch(rf"(?:_[^.]*)?(?:{suffixes})(?:\.part(?:\.json)?)?", name[len(package):], re.IGNORECASE) is not None
+
+def clear_downloads(package: str):
+    """Remove previously downloaded files and intermediates for a package"""
+    for p in Path("downloads").glob(f"{package}*"):
+        # Partial files let the direct downloader resume an interrupted fetch
+        if p.is_file() and is_package_file(p.name, package) and not p.name.endswith(PARTIAL_SUFFIXES):
+            p.unlink()
+
+def download_apkmd(app_config: config.AppConfig, version: str, arch: str, debug: bool = False) -> list:
+    """Download from APKMirror with apkmd"""
+    org = app_config.source.org
+    repo = app_config.source.repo
     
     # Update command to use determined version
     cmd = [
@@ -143,10 +188,10 @@ def download_apk(app_name: str, debug: bool = False):
         org,
         repo,
         "--version", version,
-        "--arch", config.get('arch', 'universal'),
-        "--type", config['source'].get('type', 'apk'),
+        "--arch", arch,
+        "--type", app_config.source.type,
         "--outdir", "downloads",
-        "--outfile", f"{config['package']}",
+        "--outfile", app_config.package,
         "--flatten"
     ]
     
@@ -154,26 +199,20 @@ def download_apk(app_name: str, debug: bool = False):
         cmd.append("--debug")
     
     logger.debug(f"Running command: {' '.join(cmd)}")
-    result = subprocess.run(
-        cmd,
-        capture_output=True,
-        text=True,
-        check=False
-    )
-    
-    logger.debug(f"Command output:\n{result.stdout}")
-    if result.stderr:
-        logger.error(f"Command stderr:\n{result.stderr}")
+    result = runner.run(cmd, stage="download")
     
     if result.returncode != 0:
-        raise RuntimeError(f"APKMD failed with exit code {result.returncode}\nOutput: {result.stdout}\nError: {result.stderr}")
+        raise RuntimeError(f"APKMD failed with exit code {result.returncode}\nOutput: {result.output}")
     
     # Verify download
-    apks = list(Path("downloads").glob("*.apk"))
+    apks = [
+        p for p in Path("downloads").glob(f"{app_config.package}*")
+        if is_package_file(p.name, app_config.package) and p.suffix.lower() in APK_SUFFIXES
+        and not p.stem.endswith(('_merged', '_optimized'))
+    ]
     if not apks:
         raise RuntimeError("No APKs were downloaded")
-    
-    logger.info(f"Successfully downloaded: {[apk.name for apk in apks]}")
+    return apks
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
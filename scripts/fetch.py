@@ -0,0 +1,179 @@
+"""Resumable, multi-connection HTTP download engine.
+
+Large files are split into byte ranges fetched over several pooled
+connections and written in place with pwrite, so memory stays bounded by the
+chunk size. Progress is kept next to the partial file in <dest>.part.json;
+an interrupted download resumes from the bytes already on disk as long as the
+server still reports the same size and ETag. The result is verified against
+the expected size and SHA-256 before it is moved into place.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import requests
+import net
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20
+MIN_SEGMENT_SIZE = 4 << 20
+SEGMENT_RETRIES = 3
+STATE_INTERVAL = 8 << 20  # Persist progress every 8 MB per segment
+STREAM_TIMEOUT = (10, 60)
+
+class DownloadError(RuntimeError):
+    pass
+
+def fetch(url, dest, connections=4, sha256=None, size=None) -> Path:
+    """Download url to dest, resuming a previous partial download if possible"""
+    dest = Path(dest)
+    part_file = dest.with_name(dest.name + ".part")
+    state_file = dest.with_name(dest.name + ".part.json")
+    dest.parent.mkdir(parents=True, exist_ok=True)
+
+    total, etag, ranges = _probe(url)
+    if size is not None and total is not None and total != size:
+        raise DownloadError(f"Server reports {total} bytes for {url}, expected {size}")
+
+    state = _load_state(state_file, url, total, etag) if part_file.exists() else None
+    if state is None:
+        state = {"url": url, "size": total, "etag": etag, "segments": _plan(total, ranges, connections)}
+        with open(part_file, "wb") as f:
+            if total:
+                f.truncate(total)
+    else:
+        done = sum(seg[2] for seg in state["segments"])
+        logger.info(f"Resuming {dest.name} at {done} of {total} bytes")
+
+    lock = threading.Lock()
+    fd = os.open(part_file, os.O_WRONLY)
+    try:
+        if len(state["segments"]) == 1:
+            _fetch_segment(url, fd, state["segments"][0], state, state_file, lock, ranges)
+        else:
+            with ThreadPoolExecutor(max_workers=len(state["segments"])) as executor:
+                futures = [
+                    executor.submit(_fetch_segment, url, fd, seg, state, state_file, lock, ranges)
+                    for seg in state["segments"]
+                ]
+                for future in futures:
+                    future.result()
+    finally:
+        os.close(fd)
+        with lock:
+            _save_state(state_file, state)
+
+    _verify(part_file, state, size if size is not None else total, sha256)
+    os.replace(part_file, dest)
+    state_file.unlink(missing_ok=True)
+    logger.info(f"Downloaded {dest} ({dest.stat().st_size} bytes)")
+    return dest
+
+def _probe(url):
+    """Return (size, etag, supports ranges) from a one-byte range request"""
+    response = net.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=STREAM_TIMEOUT)
+    try:
+        response.raise_for_status()
+        etag = response.headers.get("ETag")
+        if response.status_code == 206:
+            content_range = response.headers.get("Content-Range", "")
+            total = content_range.rsplit("/", 1)[-1]
+            return (int(total) if total.isdigit() else None), etag, True
+        length = response.headers.get("Content-Length")
+        return (int(length) if length else None), etag, False
+    finally:
+        response.close()
+
+def _plan(total, ranges, connections):
+    """Split the file into [start, end, done] segments, end inclusive"""
+    if not ranges or not total:
+        return [[0, (total or 0) - 1, 0]]
+    count = max(1, min(connections, total // MIN_SEGMENT_SIZE))
+    step = -(-total // count)
+    return [[start, min(start + step, total) - 1, 0] for start in range(0, total, step)]
+
+def _fetch_segment(url, fd, segment, state, state_file, lock, ranges):
+    start, end, _ = segment
+    for attempt in range(SEGMENT_RETRIES + 1):
+        offset = start + segment[2]
+        if state["size"] and offset > end:
+            return
+        headers = {}
+        if ranges:
+            headers["Range"] = f"bytes={offset}-{end}"
+            if state["etag"]:
+                headers["If-Range"] = state["etag"]
+        else:
+            # No range support: every attempt streams the whole file from the start
+            os.ftruncate(fd, 0)
+            segment[2] = 0
+            offset = 0
+
+        try:
+            with net.get(url, headers=headers, stream=True, timeout=STREAM_TIMEOUT) as response:
+                response.raise_for_status()
+                if ranges and response.status_code != 206:
+                    raise DownloadError(f"{url} changed on the server; delete the partial file and retry")
+                since_save = 0
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+                    since_save += len(chunk)
+                    with lock:
+                        segment[2] += len(chunk)
+                        if since_save >= STATE_INTERVAL:
+                            _save_state(state_file, state)
+                            since_save = 0
+            if not state["size"] or offset > end:
+                return
+            error = f"connection closed at byte {offset}"
+        except (requests.RequestException, OSError) as e:
+            if attempt == SEGMENT_RETRIES:
+                raise DownloadError(f"Segment {start}-{end} of {url} failed: {e}") from e
+            error = e
+        if attempt == SEGMENT_RETRIES:
+            raise DownloadError(f"Segment {start}-{end} of {url} failed: {error}")
+        logger.warning(f"Segment {start}-{end} failed ({error}), retrying from byte {start + segment[2]}")
+        time.sleep(2 ** attempt)
+
+def _verify(part_file, state, size, sha256):
+    # The part file is pre-sized, so its length says nothing; count the bytes each segment received
+    if state["size"]:
+        missing = [f"{start}-{end} (got {done} of {end - start + 1} bytes)"
+                   for start, end, done in state["segments"] if done != end - start + 1]
+        if missing:
+            raise DownloadError(f"Incomplete download of {part_file.name}: segments {', '.join(missing)}")
+    actual_size = part_file.stat().st_size
+    if size is not None and actual_size != size:
+        raise DownloadError(f"Size mismatch for {part_file.name}: got {actual_size}, expected {size}")
+    if sha256:
+        digest = hashlib.sha256()
+        with open(part_file, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        if digest.hexdigest() != sha256.lower():
+            part_file.unlink(missing_ok=True)
+            part_file.with_name(part_file.name + ".json").unlink(missing_ok=True)
+            raise DownloadError(f"SHA-256 mismatch for {part_file.name}: got {digest.hexdigest()}")
+
+def _load_state(state_file, url, total, etag):
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if state.get("url") != url or state.get("size") != total or state.get("etag") != etag:
+        logger.info(f"Discarding stale partial download {state_file.name}")
+        return None
+    return state
+
+def _save_state(state_file, state):
+    tmp_file = state_file.with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_file, state_file)
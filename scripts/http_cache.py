@@ -0,0 +1,154 @@
+"""On-disk HTTP cache with conditional requests.
+
+Entries live under .cache/http as <sha256(url)>.body plus a .json metadata
+file holding the final URL, ETag and Last-Modified. An entry younger than the
+configured version_check_interval is served without touching the network;
+older entries are revalidated with If-None-Match/If-Modified-Since. The cache
+is trimmed by age and total size after every write.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+import requests
+import config
+import net
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path(".cache/http")
+DEFAULT_MAX_AGE = 86400
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+MAX_ENTRY_AGE = 7 * 86400
+
+class CachedResponse:
+    """Minimal response object compatible with how the scripts use requests.Response"""
+
+    def __init__(self, url, status_code, content, headers=None, from_cache=False):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}")
+
+def get_check_interval() -> int:
+    """Read version_check_interval from the global build rules"""
+    try:
+        return config.load_build_rules().version_check_interval
+    except config.ConfigError as e:
+        logger.warning(f"Could not read version_check_interval, using {DEFAULT_MAX_AGE}s: {e}")
+        return DEFAULT_MAX_AGE
+
+def cached_get(url: str, max_age=None) -> CachedResponse:
+    """GET a URL, serving fresh cache entries and revalidating stale ones"""
+    if max_age is None:
+        max_age = get_check_interval()
+
+    key = hashlib.sha256(url.encode()).hexdigest()
+    meta_file = CACHE_DIR / f"{key}.json"
+    body_file = CACHE_DIR / f"{key}.body"
+    meta = _read_meta(meta_file, body_file)
+
+    if meta and time.time() - meta['fetched_at'] < max_age:
+        logger.debug(f"HTTP cache hit for {url}")
+        return _cached_response(meta, body_file)
+
+    headers = {}
+    if meta and meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta and meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        response = net.get(url, headers=headers)
+    except requests.RequestException as e:
+        if meta:
+            logger.warning(f"Request to {url} failed, serving stale cache entry: {e}")
+            return _cached_response(meta, body_file)
+        raise
+
+    if response.status_code == 304 and meta:
+        logger.debug(f"HTTP cache revalidated {url}")
+        meta['fetched_at'] = time.time()
+        _write_file(meta_file, json.dumps(meta).encode())
+        return _cached_response(meta, body_file)
+
+    if response.status_code == 200:
+        meta = {
+            'url': url,
+            'final_url': response.url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': time.time(),
+        }
+        _write_file(body_file, response.content)
+        _write_file(meta_file, json.dumps(meta).encode())
+        evict()
+
+    return CachedResponse(response.url, response.status_code, response.content, response.headers)
+
+def evict(max_bytes=MAX_CACHE_BYTES, max_age=MAX_ENTRY_AGE):
+    """Drop entries older than max_age, then least recently used ones until under max_bytes"""
+    if not CACHE_DIR.exists():
+        return
+
+    now = time.time()
+    entries = []
+    for body_file in CACHE_DIR.glob("*.body"):
+        try:
+            stat = body_file.stat()
+        except FileNotFoundError:
+            continue
+        if now - stat.st_mtime > max_age:
+            _remove_entry(body_file)
+        else:
+            entries.append((stat.st_atime, stat.st_size, body_file))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, body_file in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove_entry(body_file)
+        total -= size
+
+def _read_meta(meta_file, body_file):
+    try:
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if not body_file.exists():
+            return None
+        return meta
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _cached_response(meta, body_file):
+    content = body_file.read_bytes()
+    os.utime(body_file)  # Mark as recently used for LRU eviction
+    return CachedResponse(meta['final_url'], 200, content, from_cache=True)
+
+def _write_file(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_suffix(f"{path.suffix}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_file.write_bytes(data)
+    os.replace(tmp_file, path)
+
+def _remove_entry(body_file):
+    for path in (body_file, body_file.with_suffix(".json")):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
@@ -1,22 +1,35 @@
-import subprocess
 from pathlib import Path
-import yaml
 import os
+import re
+import sys
+import argparse
+import multiprocessing
 import tempfile
 import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from xml.parsers import expat
+import config
+import density
+import profiling
+import runner
+import splits
+import stage_cache
+import ziputil
 
-def load_build_rules():
-    """Load global build rules"""
-    with open("configs/build_rules.yaml") as f:
-        return yaml.safe_load(f)['global']
+APKEDITOR_JAR = Path("APKEditor.jar")
+APKEDITOR_MEMORY_MB = 2048  # One APKEditor JVM, heap and overhead
+BUILD_RULES_FILE = config.BUILD_RULES_FILE
+ALL_ARCHITECTURES = config.ALL_ARCHITECTURES
 
 def filter_dpi_resources(decoded_dir, keep_dpis):
     """Filter DPI-specific resources, keeping only specified DPIs"""
     res_dir = Path(decoded_dir) / "res"
     if not res_dir.exists():
         print(f"Resource directory {res_dir} does not exist.")
-        return
+        return 0
         
+    removed_bytes = 0
     # Get all resource directories
     for res_type_dir in res_dir.iterdir():
         if not res_type_dir.is_dir():
@@ -28,24 +41,24 @@ def filter_dpi_resources(decoded_dir, keep_dpis):
                 continue
                 
             # Parse directory name (e.g., drawable-hdpi, layout-xxhdpi)
-            dir_parts = dpi_dir.name.split('-')
-            if len(dir_parts) > 1 and any(p.endswith('dpi') for p in dir_parts[1:]):
-                # Check if directory matches any kept DPI
-                if not any(keep_dpi in dpi_dir.name for keep_dpi in keep_dpis):
-                    print(f"Removing {dpi_dir.relative_to(res_dir)}")
-                    try:
-                        shutil.rmtree(dpi_dir)
-                        print(f"Successfully removed {dpi_dir.relative_to(res_dir)}")
-                    except Exception as e:
-                        print(f"Error removing {dpi_dir.relative_to(res_dir)}: {e}")
+            if density.is_filtered_res_path(dpi_dir.relative_to(decoded_dir).parts, keep_dpis):
+                size = sum(f.stat().st_size for f in dpi_dir.rglob("*") if f.is_file())
+                print(f"Removing {dpi_dir.relative_to(res_dir)} ({size} bytes)")
+                try:
+                    shutil.rmtree(dpi_dir)
+                    removed_bytes += size
+                    print(f"Successfully removed {dpi_dir.relative_to(res_dir)}")
+                except Exception as e:
+                    print(f"Error removing {dpi_dir.relative_to(res_dir)}: {e}")
+    
+    print(f"Removed {removed_bytes} bytes of DPI-specific resources")
+    return removed_bytes
 
 def get_strip_architectures():
     """Get architectures to strip from build rules"""
-    with open("configs/build_rules.yaml") as f:
-        build_rules = yaml.safe_load(f)
-    return build_rules.get('architectures', {}).get('strip', [])
+    return config.load_build_rules().architectures.strip
 
-def build_apkeditor_command(input_dir, output_file):
+def build_apkeditor_command(input_dir, output_file, strip_archs=None):
     """Construct APKEditor build command with architecture stripping"""
     base_cmd = [
         "java", "-jar", str(Path("APKEditor.jar").resolve()),
@@ -53,100 +66,369 @@ def build_apkeditor_command(input_dir, output_file):
     ]
     
     # Add architecture stripping args
-    for arch in get_strip_architectures():
+    if strip_archs is None:
+        strip_archs = get_strip_architectures()
+    for arch in strip_archs:
         base_cmd.extend(["--remove-lib", arch])
     
     return base_cmd
 
-def optimize_apk(input_path, is_merged=False):
+class StageLedger:
+    """Records which stages ran on which artifacts and refuses to repeat one.
+
+    Artifacts are identified by content digest, so a renamed copy of an
+    already-optimized APK is still caught.
+    """
+
+    def __init__(self):
+        self.seen = {}
+
+    def claim(self, stage, artifact):
+        key = (stage, stage_cache.file_digest(artifact))
+        if key in self.seen:
+            raise RuntimeError(f"Stage '{stage}' already ran on {self.seen[key]}; refusing to repeat it on {artifact}")
+        self.seen[key] = artifact
+
+def optimize_apk(input_path, is_merged=False, output_file=None, ledger=None):
     """Optimize APK using APKEditor's capabilities"""
     input_path = Path(input_path).resolve()
-    output_file = input_path.parent / f"{input_path.stem}_optimized.apk"
+    if input_path.stem.endswith("_optimized"):
+        raise RuntimeError(f"{input_path.name} is already optimized")
+    if output_file is None:
+        output_file = input_path.parent / f"{input_path.stem}_optimized.apk"
+    if ledger is not None:
+        ledger.claim("optimize", input_path)
     
-    # Load build rules
-    build_rules = load_build_rules()
+    return stage_cache.run_cached(
+        "optimize",
+        [input_path, APKEDITOR_JAR, BUILD_RULES_FILE],
+        {"page_size": ziputil.PAGE_SIZE},
+        output_file,
+        lambda: _optimize_apk(input_path, output_file),
+    )
+
+def needs_decode(build_rules):
+    """Whether optimization needs a full decode, i.e. resources must be filtered"""
+    return bool(build_rules.dpi.keep)
+
+def strip_native_libs(input_path, output_file, archs):
+    """Copy an APK's zip entries, omitting lib/<arch>/ for each arch, aligned in the same pass"""
+    prefixes = tuple(f"lib/{arch}/" for arch in archs)
+    with profiling.stage("strip_native_libs"):
+        kept, dropped = ziputil.rewrite(input_path, output_file, lambda name: not name.startswith(prefixes), align=True)
+    print(f"Stripped {dropped} native library entries, kept {kept} entries")
+    return output_file
+
+def _optimize_apk(input_path, output_file):
+    """Decode, filter and rebuild an APK into output_file"""
+    build_rules = config.load_build_rules()
+
+    # Without resource filtering only lib/ entries change, so skip decode/rebuild
+    if not needs_decode(build_rules):
+        return strip_native_libs(input_path, output_file, build_rules.architectures.strip)
 
     # Create unique temp directory using system temp
     temp_dir = Path(tempfile.mkdtemp(prefix="apkeditor_"))
     
-    # Remove existing temp dir if needed
-    if temp_dir.exists():
-        shutil.rmtree(temp_dir)
-    
     try:
-        # Decode APK first
-        decode_cmd = ["java", "-jar", str(Path("APKEditor.jar").resolve()), "d", 
-                     "-i", str(input_path), "-o", str(temp_dir)]
-        result = subprocess.run(decode_cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            raise RuntimeError(f"APK decode failed: {result.stderr}")
+        decode_apk(input_path, temp_dir)
         
         # Filter DPI resources if configured
-        if 'dpi' in build_rules:
-            keep_dpi = build_rules['dpi'].get('keep', [])
-            if keep_dpi:
-                filter_dpi_resources(temp_dir, keep_dpi)
+        with profiling.stage("filter_dpi"):
+            filter_dpi_resources(temp_dir, build_rules.dpi.keep)
 
-        # Validate XML files
-        validate_xml_files(temp_dir)
+        # Strip empty namespaces and comments, validate XML files
+        with profiling.stage("sanitize_xml"):
+            print_xml_report(sanitize_xml_files(temp_dir))
 
-        # Replace architecture handling with new command builder
-        build_cmd = build_apkeditor_command(temp_dir, output_file)
-        
-        print(f"Running build command: {' '.join(build_cmd)}")
-        result = subprocess.run(build_cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"STDOUT: {result.stdout}")
-            print(f"STDERR: {result.stderr}")
-            raise RuntimeError(f"APK optimization failed: {result.stderr}")
-        
-        return output_file
+        return build_apk(temp_dir, output_file)
     finally:
         # Always clean up temp directory
         shutil.rmtree(temp_dir, ignore_errors=True)
 
+def decode_apk(input_path, decoded_dir):
+    """Decode an APK into decoded_dir with APKEditor"""
+    # APKEditor refuses to decode into an existing directory
+    if Path(decoded_dir).exists():
+        shutil.rmtree(decoded_dir)
+    
+    decode_cmd = ["java", "-jar", str(Path("APKEditor.jar").resolve()), "d", 
+                 "-i", str(input_path), "-o", str(decoded_dir)]
+    with profiling.stage("decode"):
+        result = runner.run(decode_cmd, stage="decode")
+    if result.returncode != 0:
+        raise RuntimeError(f"APK decode failed: {result.output}")
+    return decoded_dir
+
+def build_apk(decoded_dir, output_file, strip_archs=None):
+    """Build a decoded tree into output_file, stripping native libraries"""
+    build_cmd = build_apkeditor_command(decoded_dir, output_file, strip_archs)
+    
+    print(f"Running build command: {' '.join(build_cmd)}")
+    with profiling.stage("build"):
+        result = runner.run(build_cmd, stage="build")
+    if result.returncode != 0:
+        raise RuntimeError(f"APK optimization failed: {result.output}")
+    
+    # The output is unsigned, so it can be realigned; patching signs it afterwards
+    with profiling.stage("zipalign"):
+        ziputil.zipalign(output_file)
+    return output_file
+
+def build_workers(jobs, memory_mb=APKEDITOR_MEMORY_MB):
+    """How many APKEditor builds fit in available memory and CPUs at once"""
+    by_memory = runner.available_memory_mb() // memory_mb
+    return max(1, min(jobs, os.cpu_count() or 1, by_memory))
+
+def build_variants(input_path, variants, ledger=None, workers=None):
+    """Build one optimized APK per variant from a single decode of input_path.
+
+    Each variant is a config.Variant with a name, an arch to keep and
+    optionally its own dpi keep list. The shared tree is decoded and XML-sanitized once;
+    every variant then gets a hardlinked clone for its DPI filtering, so the
+    per-variant cost is only the rebuild. Returns {variant name: output path}.
+    """
+    input_path = Path(input_path).resolve()
+    if ledger is not None:
+        ledger.claim("optimize", input_path)
+    default_dpi = config.load_build_rules().dpi.keep
+
+    outputs = {}
+    pending = []
+    for variant in variants:
+        output_file = input_path.parent / f"{input_path.stem}_{variant.name}_optimized.apk"
+        outputs[variant.name] = output_file
+        params = {
+            "arch": variant.arch,
+            "dpi": variant.dpi if variant.dpi is not None else default_dpi,
+            "page_size": ziputil.PAGE_SIZE,
+        }
+        key = stage_cache.stage_key("optimize_variant", [input_path, APKEDITOR_JAR, BUILD_RULES_FILE], params)
+        if stage_cache.lookup(key, output_file):
+            print(f"Reusing cached optimize output for {output_file.name}")
+        else:
+            pending.append((variant, params, key, output_file))
+
+    if not pending:
+        return outputs
+
+    temp_dir = Path(tempfile.mkdtemp(prefix="apkeditor_"))
+    try:
+        shared_dir = decode_apk(input_path, temp_dir / "shared")
+        with profiling.stage("sanitize_xml"):
+            print_xml_report(sanitize_xml_files(shared_dir))
+
+        def build(item):
+            variant, params, key, output_file = item
+            variant_dir = temp_dir / variant.name
+            shutil.copytree(shared_dir, variant_dir, copy_function=os.link)
+            if params['dpi']:
+                with profiling.stage("filter_dpi", variant=variant.name):
+                    filter_dpi_resources(variant_dir, params['dpi'])
+            strip_archs = [arch for arch in ALL_ARCHITECTURES if arch != params['arch']]
+            output_file.unlink(missing_ok=True)
+            build_apk(variant_dir, output_file, strip_archs)
+            stage_cache.store(key, output_file)
+            shutil.rmtree(variant_dir, ignore_errors=True)
+
+        # The pipeline budgets one JVM for this stage; only run more if memory allows
+        workers = workers or build_workers(len(pending))
+        print(f"Building {len(pending)} variant(s) with {workers} worker(s)")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(build, pending))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return outputs
+
+# Only applied at offsets expat reports, so quoted values are never mistaken for markup
+_START_TAG_RE = re.compile(rb'<[^\s/>]+(?P<attrs>(?:\s+[^\s=/>]+\s*=\s*(?:"[^"]*"|\'[^\']*\'))*)\s*/?>')
+_ATTRIBUTE_RE = re.compile(rb'\s+([^\s=/>]+)\s*=\s*(?:"[^"]*"|\'[^\']*\')')
+
+def _strip_xml_nodes(data):
+    """Parse data with expat and cut out comment nodes and default namespace declarations.
+
+    Text, attribute values and CDATA are copied byte for byte, like the
+    xmlstarlet deletes this replaces. Raises expat.ExpatError if data is not
+    well-formed.
+    """
+    cuts = []
+    parser = expat.ParserCreate()
+
+    def comment(_):
+        start = parser.CurrentByteIndex
+        cuts.append((start, data.index(b"-->", start) + 3))
+
+    def start_element(_, attrs):
+        if "xmlns" not in attrs:
+            return
+        tag = _START_TAG_RE.match(data, parser.CurrentByteIndex)
+        if tag is None:  # Not a UTF-8 byte layout we can cut safely
+            return
+        for attribute in _ATTRIBUTE_RE.finditer(data, tag.start("attrs"), tag.end("attrs")):
+            if attribute.group(1) == b"xmlns":
+                cuts.append(attribute.span())
+
+    parser.CommentHandler = comment
+    parser.StartElementHandler = start_element
+    parser.Parse(data, True)
+
+    pieces, position = [], 0
+    for start, end in sorted(cuts):
+        pieces.append(data[position:start])
+        position = end
+    pieces.append(data[position:])
+    return b"".join(pieces)
+
+def _sanitize_xml_file(xml_file, rewrite=True):
+    """Strip default namespace declarations and comments, then check well-formedness.
+
+    Returns (path, modified, error) so results can be aggregated across workers.
+    """
+    try:
+        data = Path(xml_file).read_bytes()
+        if not data.strip():
+            return xml_file, False, None
+
+        if rewrite:
+            cleaned = _strip_xml_nodes(data)
+        else:
+            cleaned = data
+            expat.ParserCreate().Parse(data, True)
+
+        if cleaned != data:
+            Path(xml_file).write_bytes(cleaned)
+            return xml_file, True, None
+        return xml_file, False, None
+    except expat.ExpatError as e:
+        return xml_file, False, f"line {e.lineno}, column {e.offset}: {expat.ErrorString(e.code)}"
+    except (OSError, ValueError) as e:
+        return xml_file, False, str(e)
+
+def sanitize_xml_files(decoded_dir, rewrite=True, workers=None):
+    """Sanitize and validate every XML file in the decoded directory in-process.
+
+    Files that fail validation are left untouched. Returns an aggregated report
+    with the number of files checked and modified, and a list of (path, error)
+    failures.
+    """
+    xml_files = [str(p) for p in Path(decoded_dir).rglob("*.xml") if p.is_file()]
+    report = {"checked": len(xml_files), "modified": 0, "failures": []}
+    if not xml_files:
+        return report
+
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(xml_files) // (workers * 8))
+    worker = partial(_sanitize_xml_file, rewrite=rewrite)
+
+    if workers == 1:
+        results = map(worker, xml_files)
+        report = _collect_xml_results(results, report)
+    else:
+        # Callers run this from worker threads; forking a multithreaded process can deadlock
+        context = multiprocessing.get_context("forkserver")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            results = executor.map(worker, xml_files, chunksize=chunksize)
+            report = _collect_xml_results(results, report)
+
+    return report
+
+def _collect_xml_results(results, report):
+    for xml_file, modified, error in results:
+        if error:
+            report["failures"].append((xml_file, error))
+        elif modified:
+            report["modified"] += 1
+    return report
+
+def print_xml_report(report):
+    """Print a summary of a sanitize_xml_files report"""
+    print(f"Checked {report['checked']} XML files, sanitized {report['modified']}, "
+          f"{len(report['failures'])} invalid")
+    for xml_file, error in report["failures"]:
+        print(f"XML validation failed for {xml_file}: {error}")
+
 def validate_xml_files(decoded_dir):
-    """Validate XML files in the decoded directory"""
-    for xml_file in Path(decoded_dir).rglob("*.xml"):
-        try:
-            # Use xmllint to validate XML
-            result = subprocess.run(["xmllint", "--noout", str(xml_file)], capture_output=True, text=True)
-            if result.returncode != 0:
-                print(f"XML validation failed for {xml_file}: {result.stderr}")
-                raise RuntimeError(f"Invalid XML: {xml_file}")
-        except Exception as e:
-            print(f"Error validating {xml_file}: {e}")
+    """Validate XML files in the decoded directory without rewriting them"""
+    report = sanitize_xml_files(decoded_dir, rewrite=False)
+    print_xml_report(report)
+    return report
+
+def merge_splits(input_path, ledger=None, archs=None, keep_dpis=None):
+    """Merge split APKs into a single intermediate APK.
 
-def merge_splits(input_path):
-    """Merge split APKs and optimize the result"""
+    Only the base, feature and language splits, the ABI splits for archs and
+    the density splits in keep_dpis are handed to APKEditor.
+    """
+    if ledger is not None:
+        ledger.claim("merge", input_path)
     merged_file = input_path.parent / f"{input_path.stem}_merged.apk"
-    
+    if archs is None:
+        archs = [arch for arch in ALL_ARCHITECTURES if arch not in get_strip_architectures()]
+    if keep_dpis is None:
+        keep_dpis = config.load_build_rules().dpi.keep
+    selected_file = input_path.parent / f"{input_path.stem}_selected{input_path.suffix}"
+
     # Merge command
     merge_cmd = [
         "java", "-jar", "APKEditor.jar", "m",
-        "-i", str(input_path),
+        "-i", str(selected_file),
         "-o", str(merged_file),
         "--legacy"
     ]
     
-    result = subprocess.run(merge_cmd, capture_output=True, text=True)
-    if result.returncode != 0:
-        raise RuntimeError(f"Merge failed: {result.stderr}")
+    def merge():
+        try:
+            with profiling.stage("select_splits"):
+                kept, dropped = splits.select(input_path, selected_file, archs, keep_dpis)
+            print(f"Merging {len(kept)} split(s), skipped {len(dropped)}: {', '.join(dropped) or 'none'}")
+            with profiling.stage("merge"):
+                result = runner.run(merge_cmd, stage="merge")
+        finally:
+            selected_file.unlink(missing_ok=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Merge failed: {result.output}")
     
-    # Optimize the merged APK
-    return optimize_apk(merged_file, is_merged=True)
+    params = {"legacy": True, "archs": sorted(archs), "dpi": sorted(keep_dpis)}
+    return stage_cache.run_cached("merge", [input_path, APKEDITOR_JAR], params, merged_file, merge)
+
+def process_apk(input_path, variants=None):
+    """Process APK - either merge+optimize or just optimize.
 
-def process_apk(input_path):
-    """Process APK - either merge+optimize or just optimize"""
+    Bundles are merged once and the merged APK is decoded, filtered and
+    rebuilt exactly once; the ledger rejects any repeated stage. With
+    variants, returns {variant name: optimized APK} built from one decode.
+    """
+    ledger = StageLedger()
     try:
         if not input_path.exists():
             raise FileNotFoundError(f"Input file not found: {input_path}")
             
-        if needs_merging(input_path):
-            merged = merge_splits(input_path)
-            return optimize_apk(merged)  # Optimize after merging
+        if variants:
+            if needs_merging(input_path):
+                # Every variant is built from the one merge, so keep the splits any of them needs
+                default_dpi = config.load_build_rules().dpi.keep
+                dpi_lists = [variant.dpi if variant.dpi is not None else default_dpi for variant in variants]
+                keep_dpis = sorted(set().union(*dpi_lists)) if all(dpi_lists) else []  # [] keeps every density
+                archs = [variant.arch for variant in variants]
+                source = merge_splits(input_path, ledger, archs, keep_dpis)
+            else:
+                source = input_path
+            try:
+                return build_variants(source, variants, ledger)
+            finally:
+                if source != input_path:
+                    Path(source).unlink(missing_ok=True)
+        elif needs_merging(input_path):
+            merged = merge_splits(input_path, ledger)
+            output_file = input_path.parent / f"{input_path.stem}_optimized.apk"
+            try:
+                return optimize_apk(merged, is_merged=True, output_file=output_file, ledger=ledger)
+            finally:
+                # The merged APK is only an intermediate; the stage cache keeps a copy
+                Path(merged).unlink(missing_ok=True)
         else:
-            return optimize_apk(input_path)  # Direct optimization
+            return optimize_apk(input_path, ledger=ledger)  # Direct optimization
     except Exception as e:
         print(f"Error processing {input_path.name}: {str(e)}")
         raise
@@ -156,16 +438,19 @@ def needs_merging(file_path):
 
 def should_check_app(app_name):
     """Check if app is configured to use bundles/splits"""
-    config_file = Path("configs/apps") / f"{app_name}.yaml"
-    if not config_file.exists():
+    if not (config.APPS_DIR / f"{app_name}.yaml").exists():
         return False
-        
-    with open(config_file) as f:
-        config = yaml.safe_load(f)
-    
-    return config['source'].get('type', 'apk') in ['bundle', 'split']
+    return config.load_app(app_name).source.type in ['bundle', 'split']
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sanitize-xml", metavar="DIR", help="Only sanitize and validate XML files in a decoded tree")
+    args = parser.parse_args()
+
+    if args.sanitize_xml:
+        print_xml_report(sanitize_xml_files(args.sanitize_xml))
+        sys.exit(0)
+
     for apk in Path("downloads").rglob("*.*"):  # Use rglob to find all files recursively
         if apk.suffix.lower() not in ['.apk', '.apks', '.xapk', '.apkm']:
             continue  # Skip non-APK files
@@ -0,0 +1,57 @@
+"""Shared HTTP session with pooled keep-alive connections.
+
+Every request goes through one requests.Session whose adapters keep a pool of
+connections per host, retry with exponential backoff on 429/5xx (honouring
+Retry-After) and cap the number of in-flight requests per host.
+"""
+import logging
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10
+POOL_SIZE = 16
+HOST_CONCURRENCY = 4
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+_host_limits = {}
+
+def get_session() -> requests.Session:
+    """Get the process-wide session, creating it on first use"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=5,
+                backoff_factor=0.5,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=frozenset(["GET", "HEAD"]),
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+def host_limit(url: str) -> threading.BoundedSemaphore:
+    """Get the semaphore bounding concurrent requests to the URL's host"""
+    host = urlsplit(url).netloc
+    with _session_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(HOST_CONCURRENCY)
+        return _host_limits[host]
+
+def get(url: str, timeout=DEFAULT_TIMEOUT, **kwargs) -> requests.Response:
+    """GET a URL through the shared session, respecting the per-host limit"""
+    with host_limit(url):
+        logger.debug(f"GET {url}")
+        return get_session().get(url, timeout=timeout, **kwargs)
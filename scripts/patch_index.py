@@ -0,0 +1,146 @@
+"""Content-hashed compatibility index for patches.json.
+
+The index maps each package to its natsorted compatible versions and each
+patch name to the packages and versions it supports. It is built in one pass
+over patches.json, stored under .cache/patch_index keyed by the file's
+SHA-256 and reused by every script and app in a run.
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from natsort import natsorted
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = Path(".cache/patch_index")
+PATCHES_FILES = ["patches.json", "patches.json.1", "patches.json.2"]
+INDEX_FORMAT = 2  # Bump when the index layout changes so stale cache files are ignored
+
+# In-process memo: sha256 -> index, and (path, mtime, size) -> sha256
+_indexes = {}
+_file_hashes = {}
+
+def build_index(patches) -> dict:
+    """Build package -> versions and patch -> compatibility indexes in a single pass"""
+    if not isinstance(patches, list):
+        raise ValueError(f"Expected list of patches, got {type(patches)}")
+
+    packages = {}
+    patch_compat = {}
+    for patch in patches:
+        if not isinstance(patch, dict):
+            continue
+        name = patch.get("name")
+
+        # In patches.json, compatiblePackages can be a dict or list
+        compatible_packages = patch.get("compatiblePackages") or []
+        if isinstance(compatible_packages, dict):
+            items = compatible_packages.items()
+        else:
+            items = (
+                (pkg.get("name"), pkg.get("versions"))
+                for pkg in compatible_packages
+                if isinstance(pkg, dict) and pkg.get("name")
+            )
+
+        # None means the patch applies to any package; a package mapped to None to any version
+        compat = None if not compatible_packages else {}
+        for package, versions in items:
+            known = packages.setdefault(package, set())
+            if isinstance(versions, list):
+                known.update(versions)
+                compat[package] = natsorted(versions)
+            else:
+                compat[package] = None
+
+        if name:
+            patch_compat[name] = {"packages": compat, "use": patch.get("use", True)}
+
+    return {
+        "format": INDEX_FORMAT,
+        "packages": {pkg: natsorted(versions) for pkg, versions in packages.items()},
+        "patches": patch_compat,
+    }
+
+def load_index(content: bytes) -> dict | None:
+    """Get the index for patches.json content, building and persisting it on first use"""
+    if isinstance(content, str):
+        content = content.encode()
+    sha256 = hashlib.sha256(content).hexdigest()
+    return _load_index_by_hash(sha256, lambda: content)
+
+def load_local_index(filenames=None) -> dict | None:
+    """Get the index for the first non-empty local patches.json"""
+    for fn in filenames or PATCHES_FILES:
+        patches_file = Path(fn)
+        try:
+            stat = patches_file.stat()
+        except FileNotFoundError:
+            continue
+        if stat.st_size == 0:
+            continue
+
+        key = (str(patches_file.resolve()), stat.st_mtime_ns, stat.st_size)
+        sha256 = _file_hashes.get(key)
+        if sha256 is None:
+            sha256 = _hash_file(patches_file)
+            _file_hashes[key] = sha256
+
+        index = _load_index_by_hash(sha256, patches_file.read_bytes)
+        if index is not None:
+            return index
+    return None
+
+def get_versions(index: dict, package: str) -> list:
+    """Look up the natsorted compatible versions for a package"""
+    return index["packages"].get(package, [])
+
+def get_patch(index: dict, name: str) -> dict | None:
+    """Look up a patch's compatibility ({"packages": ..., "use": ...}) by name"""
+    return index["patches"].get(name)
+
+def _load_index_by_hash(sha256, read_content):
+    index = _indexes.get(sha256)
+    if index is not None:
+        return index
+
+    index_file = INDEX_DIR / f"{sha256}.v{INDEX_FORMAT}.json"
+    try:
+        with open(index_file) as f:
+            index = json.load(f)
+        logger.debug(f"Loaded patch index {index_file}")
+    except (FileNotFoundError, json.JSONDecodeError):
+        content = read_content().strip()
+        if not content:
+            return None
+        try:
+            index = build_index(json.loads(content))
+        except (json.JSONDecodeError, ValueError) as e:
+            logger.error(f"Invalid patches.json content: {e}")
+            return None
+        index["sha256"] = sha256
+        _write_index(index_file, index)
+
+    _indexes[sha256] = index
+    return index
+
+def _write_index(index_file, index):
+    """Atomically persist an index so concurrent scripts never read a partial file"""
+    try:
+        index_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = index_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(index, f, separators=(",", ":"))
+        os.replace(tmp_file, index_file)
+        logger.debug(f"Wrote patch index {index_file}")
+    except OSError as e:
+        logger.warning(f"Could not persist patch index {index_file}: {e}")
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
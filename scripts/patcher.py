@@ -1,25 +1,39 @@
-import yaml
-import subprocess
 from pathlib import Path
 import argparse
+import os
+import shutil
 import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import config
+import runner
+import stage_cache
+import ziputil
 
-def apply_patches(apk_path, app_config):
+# Explicit heap per revanced-cli JVM; concurrency is derived from available RAM
+PATCH_HEAP_MB = 2048
+JVM_OVERHEAD_MB = 512  # Metaspace, code cache and native buffers on top of the heap
+
+def apply_patches(apk_path, app_config, output_apk=None, heap_mb=PATCH_HEAP_MB):
     """Apply ReVanced patches to an APK"""
-    output_apk = Path("dist") / f"{apk_path.stem}_patched.apk"
+    output_apk = Path(output_apk or Path("dist") / f"{apk_path.stem}_patched.apk")
+    output_apk.parent.mkdir(parents=True, exist_ok=True)
     
+    # revanced-cli defaults to a temp dir next to the output; concurrent jobs must not share it
+    temp_dir = tempfile.mkdtemp(prefix=f"revanced_{apk_path.stem}_")
     base_cmd = [
-        "java", "-jar", "revanced-cli-all.jar", "patch",
+        "java", f"-Xmx{heap_mb}m", "-jar", "revanced-cli-all.jar", "patch",
         "-p", "patches.rvp",
         "--legacy-options=options.json",
+        "--temporary-files-path", temp_dir,
         "--purge",
         "-o", str(output_apk),
         str(apk_path)
     ]
     
     # Handle patch inclusion/exclusion
-    include_patches = app_config['patches'].get('include', [])
-    exclude_patches = app_config['patches'].get('exclude', [])
+    include_patches = app_config.patches.include
+    exclude_patches = app_config.patches.exclude
     
     if include_patches:
         base_cmd.extend(["-e", ",".join(include_patches)])
@@ -27,26 +41,79 @@ def apply_patches(apk_path, app_config):
     if exclude_patches:
         base_cmd.extend(["-d", ",".join(exclude_patches)])
     
-    print(f"Running command: {' '.join(base_cmd)}")
-    result = subprocess.run(base_cmd, capture_output=True, text=True)
-    if result.returncode != 0:
-        print(f"STDOUT: {result.stdout}")
-        print(f"STDERR: {result.stderr}")
-        raise RuntimeError(f"Patching failed with code {result.returncode}")
+    def patch():
+        print(f"Running command: {' '.join(base_cmd)}")
+        result = runner.run(base_cmd, stage="patch")
+        if result.returncode != 0:
+            print(f"Output tail:\n{result.output}")
+            raise RuntimeError(f"Patching failed with code {result.returncode}")
+        
+        # Realigning a signed APK would invalidate its v2+ signature, so only report
+        problems = ziputil.verify_alignment(output_apk)
+        if problems:
+            print(f"Warning: {output_apk.name} has {len(problems)} unaligned or compressed entries, e.g.:")
+            for problem in problems[:5]:
+                print(f"  {problem}")
+    
+    try:
+        return stage_cache.run_cached(
+            "patch",
+            [apk_path, "patches.rvp", "options.json", "revanced-cli-all.jar"],
+            {"include": include_patches, "exclude": exclude_patches},
+            output_apk,
+            patch,
+        )
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def patch_workers(jobs, heap_mb=PATCH_HEAP_MB):
+    """How many patch JVMs fit in available memory and CPUs at once"""
+    by_memory = runner.available_memory_mb() // (heap_mb + JVM_OVERHEAD_MB)
+    return max(1, min(jobs, os.cpu_count() or 1, by_memory))
+
+def output_paths(apks):
+    """Patched output path per APK, disambiguated when two inputs share a name"""
+    names = [f"{apk.stem}_patched.apk" for apk in apks]
+    outputs = []
+    for apk, name in zip(apks, names):
+        if names.count(name) > 1:
+            name = f"{apk.parent.name}_{name}"
+        outputs.append(Path("dist") / name)
+    return outputs
+
+def patch_all(apks, app_config, workers=None, heap_mb=PATCH_HEAP_MB):
+    """Patch several APKs concurrently; returns patched paths in input order"""
+    apks = [Path(apk) for apk in apks]
+    workers = workers or patch_workers(len(apks), heap_mb)
+    print(f"Patching {len(apks)} APK(s) with {workers} worker(s), {heap_mb} MB heap each")
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(apply_patches, apk, app_config, output, heap_mb)
+            for apk, output in zip(apks, output_paths(apks))
+        ]
     
-    return output_apk
+    patched, errors = [], []
+    for apk, future in zip(apks, futures):
+        try:
+            patched.append(future.result())
+        except Exception as e:
+            errors.append(f"{apk.name}: {e}")
+    if errors:
+        raise RuntimeError("Patching failed for " + "; ".join(errors))
+    return patched
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--app', required=True)
     parser.add_argument('--version')
     parser.add_argument('--patch-version')
+    parser.add_argument('--workers', type=int, help="Concurrent patch jobs (default: by available memory)")
+    parser.add_argument('--heap-mb', type=int, default=PATCH_HEAP_MB, help="Heap size per revanced-cli JVM")
     args = parser.parse_args()
     
     try:
-        config_file = Path("configs/apps") / f"{args.app}.yaml"
-        with open(config_file) as f:
-            app_config = yaml.safe_load(f)
+        app_config = config.load_app(args.app)
         
         # Look for merged APKs in all subdirectories
         apks = list(Path("dist").rglob("*_optimized.apk"))
@@ -54,9 +121,7 @@ if __name__ == "__main__":
         if not apks:
             raise RuntimeError(f"No APK found for {args.app}")
             
-        for apk in apks:
-            print(f"Patching {apk.name}...")
-            patched = apply_patches(apk, app_config)
+        for patched in patch_all(apks, app_config, args.workers, args.heap_mb):
             print(f"Patched APK: {patched.name}")
             
     except Exception as e:
@@ -0,0 +1,377 @@
+"""Pipeline orchestrator: download → merge/optimize → patch → delta.
+
+Builds a dependency graph of stages per app and per downloaded APK and runs
+independent stages concurrently under CPU and memory budgets. Artifact paths
+are passed explicitly from each stage to its dependents, and completed stages
+are recorded in .cache/pipeline/state.json so a failed run resumes from the
+last completed stage. Each record carries the stage's key (resolved upstream
+version, config and tool digests) and the digests of its inputs and outputs;
+a record that no longer matches is dropped and the stage runs again.
+"""
+import argparse
+import dataclasses
+import json
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+import config
+import delta
+import downloader
+import merger
+import patcher
+import planner
+import preflight
+import retention
+import profiling
+import runner
+import stage_cache
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = Path(".cache/pipeline/state.json")
+APK_SUFFIXES = ['.apk', '.apks', '.xapk', '.apkm']
+
+# Rough per-stage resource costs; the JVM stages dominate memory use
+DOWNLOAD_COST = (1, 256)
+OPTIMIZE_COST = (2, merger.APKEDITOR_MEMORY_MB)
+PATCH_COST = (2, patcher.PATCH_HEAP_MB + patcher.JVM_OVERHEAD_MB)
+DELTA_COST = (1, 256)
+PATCH_TOOLS = ["patches.rvp", "options.json", "revanced-cli-all.jar"]
+
+class Stage:
+    """A unit of work in the pipeline graph.
+
+    action receives {dependency id: output} and returns this stage's output,
+    a path or list of paths. expand, if set, receives the output and returns
+    further stages that depend on it. key, if set, returns what else the
+    output depends on (e.g. the resolved upstream version); a recorded output
+    is only resumed while key and the input digests are unchanged.
+    """
+    __slots__ = ("id", "deps", "action", "cpu", "memory_mb", "expand", "key")
+
+    def __init__(self, id, action, deps=(), cost=(1, 256), expand=None, key=None):
+        self.id = id
+        self.deps = list(deps)
+        self.action = action
+        self.cpu, self.memory_mb = cost
+        self.expand = expand
+        self.key = key
+
+class Scheduler:
+    """Run a stage graph concurrently within CPU and memory budgets"""
+
+    def __init__(self, cpu_budget=None, memory_budget_mb=None, state_file=STATE_FILE, resume=True):
+        self.cpu_budget = cpu_budget or os.cpu_count() or 1
+        self.memory_budget_mb = memory_budget_mb or runner.available_memory_mb()
+        self.state_file = Path(state_file)
+        self.state = self._load_state() if resume else {}
+        self.state_lock = threading.Lock()
+        self.stages = {}
+        self.keys = {}  # Stage id -> key, computed once per run
+
+    def add(self, stage):
+        if stage.id in self.stages:
+            raise ValueError(f"Duplicate stage: {stage.id}")
+        self.stages[stage.id] = stage
+
+    def run(self):
+        """Run every stage; returns (outputs, failed stage ids)"""
+        pending = dict(self.stages)
+        done = {}
+        failed = set()
+        running = {}
+        cpu_free, memory_free = self.cpu_budget, self.memory_budget_mb
+
+        with ThreadPoolExecutor(max_workers=self.cpu_budget) as executor:
+            while pending or running:
+                progressed = False
+                for stage in list(pending.values()):
+                    if any(dep in failed for dep in stage.deps):
+                        logger.error(f"Skipping {stage.id}: a dependency failed")
+                        failed.add(stage.id)
+                        del pending[stage.id]
+                        progressed = True
+                        continue
+                    if not all(dep in done for dep in stage.deps):
+                        continue
+
+                    inputs = {dep: done[dep] for dep in stage.deps}
+                    resumed = self._resumed_output(stage, inputs)
+                    if resumed is not None:
+                        logger.info(f"Resuming: {stage.id} already completed")
+                        del pending[stage.id]
+                        self._complete(stage, resumed, done, pending)
+                        progressed = True
+                        continue
+
+                    # Always let one stage run, even if it exceeds the budget on its own
+                    fits = stage.cpu <= cpu_free and stage.memory_mb <= memory_free
+                    if fits or not running:
+                        logger.info(f"Starting {stage.id}")
+                        running[executor.submit(stage.action, inputs)] = stage
+                        cpu_free -= stage.cpu
+                        memory_free -= stage.memory_mb
+                        del pending[stage.id]
+                        progressed = True
+
+                if not running:
+                    if progressed:
+                        continue
+                    for stage_id in pending:
+                        logger.error(f"Stage {stage_id} has unresolved dependencies")
+                    failed.update(pending)
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    cpu_free += stage.cpu
+                    memory_free += stage.memory_mb
+                    try:
+                        output = future.result()
+                    except Exception as e:
+                        logger.error(f"Stage {stage.id} failed: {e}")
+                        failed.add(stage.id)
+                        continue
+                    logger.info(f"Finished {stage.id}: {output}")
+                    self._record(stage, output, {dep: done[dep] for dep in stage.deps})
+                    self._complete(stage, output, done, pending)
+
+        if not failed:
+            self._clear_state()
+        return done, failed
+
+    def _complete(self, stage, output, done, pending):
+        done[stage.id] = output
+        if stage.expand:
+            for child in stage.expand(output):
+                self.add(child)
+                pending[child.id] = child
+
+    def _resumed_output(self, stage, inputs):
+        entry = self.state.get(stage.id)
+        if entry is None:
+            return None
+        current = (
+            isinstance(entry, dict)
+            and entry.get("key") is not None
+            and entry["key"] == self._stage_key(stage)
+            and entry.get("inputs") == _digests(inputs.values())
+            and entry.get("outputs") == _digests([entry["output"]])
+        )
+        if not current:
+            logger.info(f"Discarding stale resume state for {stage.id}")
+            with self.state_lock:
+                self.state.pop(stage.id, None)
+                self._write_state()
+            return None
+        return entry["output"]
+
+    def _stage_key(self, stage):
+        if stage.id not in self.keys:
+            try:
+                self.keys[stage.id] = json.loads(json.dumps(stage.key() if stage.key else {}, sort_keys=True))
+            except Exception as e:
+                logger.warning(f"Could not compute resume key for {stage.id}: {e}")
+                self.keys[stage.id] = None  # Never resumable this run
+        return self.keys[stage.id]
+
+    def _load_state(self):
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _record(self, stage, output, inputs):
+        entry = {
+            "output": output,
+            "key": self._stage_key(stage),
+            "inputs": _digests(inputs.values()),
+            "outputs": _digests([output]),
+        }
+        with self.state_lock:
+            self.state[stage.id] = entry
+            self._write_state()
+
+    def _write_state(self):
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.state_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_file, self.state_file)
+
+    def _clear_state(self):
+        self.state = {}
+        self.state_file.unlink(missing_ok=True)
+
+def _digests(outputs):
+    """SHA-256 of every path in a list of stage outputs (paths or lists of paths)"""
+    digests = []
+    for output in outputs:
+        for path in output if isinstance(output, list) else [output]:
+            digests.append(stage_cache.file_digest(path))
+    return digests
+
+def add_app(scheduler, app_name, patch=True, only_variants=None):
+    """Add the download → optimize → patch graph for one app, optionally for some variants only"""
+    app_config = config.load_app(app_name)
+
+    download_id = f"download:{app_name}"
+    variants = downloader.get_variants(app_config)
+    if only_variants:
+        unknown = set(only_variants) - {variant.name for variant in variants}
+        if unknown:
+            raise RuntimeError(f"{app_name} has no variant(s): {', '.join(sorted(unknown))}")
+        variants = [variant for variant in variants if variant.name in only_variants]
+
+    def download(inputs):
+        with profiling.stage("download", app=app_name):
+            return [str(p) for p in downloader.download_apk(app_name)]
+
+    def expand(downloaded):
+        stages = []
+        for apk in downloaded:
+            apk = Path(apk)
+            if apk.suffix.lower() not in APK_SUFFIXES:
+                continue
+            optimize_id = f"optimize:{app_name}:{apk.name}"
+            if variants:
+                # One decode feeds every variant; patch stages fan out per variant
+                stages.append(Stage(optimize_id, _optimize_variants_action(app_name, apk, variants),
+                                    deps=[download_id], cost=OPTIMIZE_COST,
+                                    expand=_variant_patches(app_name, apk, optimize_id, variants, app_config) if patch else None,
+                                    key=_optimize_key(variants)))
+                continue
+            stages.append(Stage(optimize_id, _optimize_action(app_name, apk), deps=[download_id],
+                                cost=OPTIMIZE_COST, key=_optimize_key()))
+            if patch:
+                patch_id = f"patch:{app_name}:{apk.name}"
+                stages.append(Stage(patch_id, _patch_action(app_name, optimize_id, app_config),
+                                    deps=[optimize_id], cost=PATCH_COST, key=_patch_key(app_config)))
+                stages.append(Stage(f"delta:{app_name}:{apk.name}", _delta_action(app_name, patch_id),
+                                    deps=[patch_id], cost=DELTA_COST))
+        return stages
+
+    def download_key():
+        version = planner.resolve_apk_version(app_config)
+        if not config.is_pinned(version):
+            raise RuntimeError(f"could not resolve the upstream version of {app_name}")
+        return {
+            "version": version,
+            "source": dataclasses.asdict(app_config.source),
+            "arch": downloader.get_download_arch(app_config),
+        }
+
+    scheduler.add(Stage(download_id, download, cost=DOWNLOAD_COST, expand=expand, key=download_key))
+
+def _optimize_key(variants=()):
+    def key():
+        rules = config.load_build_rules()
+        return {
+            "architectures": dataclasses.asdict(rules.architectures),
+            "dpi": dataclasses.asdict(rules.dpi),
+            "variants": [dataclasses.asdict(variant) for variant in variants],
+            "apkeditor": stage_cache.file_digest(merger.APKEDITOR_JAR),
+        }
+    return key
+
+def _patch_key(app_config):
+    def key():
+        return {
+            "patches": dataclasses.asdict(app_config.patches),
+            "tools": {name: stage_cache.file_digest(name) for name in PATCH_TOOLS},
+        }
+    return key
+
+def _optimize_action(app_name, apk):
+    def optimize(inputs):
+        with profiling.stage("optimize", app=app_name, apk=apk.name):
+            return str(merger.process_apk(apk))
+    return optimize
+
+def _optimize_variants_action(app_name, apk, variants):
+    def optimize(inputs):
+        with profiling.stage("optimize", app=app_name, apk=apk.name):
+            outputs = merger.process_apk(apk, variants)
+        return [str(outputs[variant.name]) for variant in variants]
+    return optimize
+
+def _variant_patches(app_name, apk, optimize_id, variants, app_config):
+    def expand(outputs):
+        stages = []
+        for index, variant in enumerate(variants):
+            patch_id = f"patch:{app_name}:{apk.name}:{variant.name}"
+            stages.append(Stage(patch_id, _patch_action(app_name, optimize_id, app_config, index),
+                                deps=[optimize_id], cost=PATCH_COST, key=_patch_key(app_config)))
+            stages.append(Stage(f"delta:{app_name}:{apk.name}:{variant.name}",
+                                _delta_action(app_name, patch_id, variant.name),
+                                deps=[patch_id], cost=DELTA_COST))
+        return stages
+    return expand
+
+def _patch_action(app_name, optimize_id, app_config, index=None):
+    def patch(inputs):
+        Path("dist").mkdir(exist_ok=True)
+        output = inputs[optimize_id]
+        apk = Path(output if index is None else output[index])
+        with profiling.stage("patch", app=app_name, apk=apk.name):
+            return str(patcher.apply_patches(apk, app_config))
+    return patch
+
+def _delta_action(app_name, patch_id, variant=None):
+    def make_delta(inputs):
+        apk = Path(inputs[patch_id])
+        with profiling.stage("delta", app=app_name, apk=apk.name):
+            delta_path = delta.release(app_name, apk, variant)
+        # The patched APK stands in as this stage's output on a first release
+        return str(delta_path or apk)
+    return make_delta
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the download → optimize → patch pipeline")
+    parser.add_argument("--app", action="append", help="App identifier (repeatable)")
+    parser.add_argument("--all", action="store_true", help="Build every app in configs/apps")
+    parser.add_argument("--variant", action="append", help="Only build these variants (repeatable)")
+    parser.add_argument("--cpu", type=int, help="CPU budget (default: all cores)")
+    parser.add_argument("--memory-mb", type=int, help="Memory budget in MB (default: available memory)")
+    parser.add_argument("--fresh", action="store_true", help="Ignore state from a previous failed run")
+    parser.add_argument("--no-patch", action="store_true", help="Stop after optimization")
+    parser.add_argument("--skip-preflight", action="store_true", help="Do not validate patch configs first")
+    parser.add_argument("--profile-json", help="Path of the JSON timing report")
+    parser.add_argument("--profile-prom", help="Path of the Prometheus textfile")
+    args = parser.parse_args()
+
+    apps = args.app or []
+    if args.all:
+        apps = config.app_names()
+    if not apps:
+        parser.error("Specify --app or --all")
+
+    # Report every schema error in build rules and app configs before any stage starts
+    errors = config.validate(apps)
+    if errors:
+        print(config.ConfigError(errors))
+        sys.exit(1)
+
+    # Catch patch typos and unsupported versions before anything is downloaded
+    if not args.no_patch and not args.skip_preflight and not preflight.preflight(apps):
+        sys.exit(1)
+
+    retention.print_summary(retention.collect())
+
+    scheduler = Scheduler(args.cpu, args.memory_mb, resume=not args.fresh)
+    for app_name in apps:
+        add_app(scheduler, app_name, patch=not args.no_patch, only_variants=args.variant)
+
+    outputs, failed = scheduler.run()
+    for report in profiling.profiler.write_reports(args.profile_json, args.profile_prom):
+        print(f"Wrote profile report {report}")
+    for stage_id, output in outputs.items():
+        print(f"{stage_id}: {output}")
+    if failed:
+        print(f"Failed stages: {', '.join(sorted(failed))}")
+        sys.exit(1)
@@ -0,0 +1,206 @@
+"""Build planner: the minimal (app, variant) matrix for a run.
+
+For every app in configs/apps the planner resolves the upstream version that
+would be downloaded and the patch release, and compares them with what
+versions.lock records as last built. A digest of each variant's effective
+config (app config plus the build rules that shape its output) is compared
+too, and a variant whose patched APK is missing (from the published release
+assets given with --assets, else from output_dir) is rebuilt. Only pairs with
+at least one reason are emitted, so the workflow never starts a runner that
+has nothing to do. `--record` stores a finished build's inputs in the state
+store (and versions.lock) for the next plan; with --record-file they are
+written to JSON instead, for a single job to `--apply` after a matrix build.
+"""
+import argparse
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+import config
+import downloader
+import stage_cache
+import state_store
+import version_check
+
+logger = logging.getLogger(__name__)
+
+def variant_names(app_config):
+    """Variants an app builds, or [None] for a single universal build"""
+    return [variant.name for variant in downloader.get_variants(app_config)] or [None]
+
+def config_digest(app_config, rules, variant=None):
+    """Digest of everything in the configs that affects one variant's output"""
+    app = dataclasses.asdict(app_config)
+    app["variants"] = [v for v in app["variants"] if v["name"] == variant]
+    if variant and not app["variants"]:
+        app["arch"] = variant  # Variant derived from an arch list
+    material = {
+        "app": app,
+        "architectures": dataclasses.asdict(rules.architectures),
+        "dpi": dataclasses.asdict(rules.dpi),
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode()).hexdigest()[:16]
+
+def resolve_apk_version(app_config):
+    """The upstream version a build would download now"""
+    version = downloader.resolve_version(app_config)
+    source = app_config.source
+    if not config.is_pinned(version) and source.org and source.repo:
+        version = version_check.get_latest_version(source.org, source.repo) or version
+    return version
+
+def match_artifact(app_config, variant, names):
+    """The patched APK file name in names for this app and variant, or None"""
+    variants = set(variant_names(app_config)) - {None}
+    for name in sorted(names):
+        if not (downloader.is_package_file(name, app_config.package) and name.endswith("_optimized_patched.apk")):
+            continue
+        built = next((v for v in variants if name.endswith(f"_{v}_optimized_patched.apk")), None)
+        if built == variant:
+            return name
+    return None
+
+def find_artifact(app_config, variant, output_dir):
+    """The patched APK for this app and variant in output_dir, or None"""
+    name = match_artifact(app_config, variant, (path.name for path in Path(output_dir).glob("*.apk")))
+    return Path(output_dir) / name if name else None
+
+def plan(app_names=None, patch_release=None, force=(), assets=None):
+    """[{"app", "variant", "reason"}] for every (app, variant) that needs building.
+
+    assets are the file names already published; None checks output_dir instead.
+    """
+    rules = config.load_build_rules()
+    apps = config.load_apps(app_names)
+    lock = state_store.store.lock()
+    releases = {}
+    entries = []
+
+    for app_name, app_config in apps.items():
+        reasons = []
+        if app_name in force:
+            reasons.append("forced")
+        try:
+            apk = resolve_apk_version(app_config)
+        except RuntimeError as e:
+            # Let the build run and fail visibly rather than silently dropping the app
+            apk = None
+            reasons.append(f"could not resolve version: {e}")
+
+        patches = patch_release
+        if patches is None and app_config.patches.source:
+            source = app_config.patches.source
+            if source not in releases:
+                try:
+                    releases[source] = version_check.get_patch_version(source)
+                except Exception as e:
+                    logger.warning(f"Could not resolve patch release from {source}: {e}")
+                    releases[source] = None
+            patches = releases[source]
+
+        locked = lock.get(app_name) or {}
+        if not locked:
+            reasons.append("not in versions.lock")
+        else:
+            locked_apk, _, locked_patches = str(locked.get("apk_version", "")).partition(" ")
+            if apk and apk != locked_apk:
+                reasons.append(f"apk {locked_apk or '?'} → {apk}")
+            if patches and patches != locked_patches:
+                reasons.append(f"patches {locked_patches or '?'} → {patches}")
+
+        built = locked.get("inputs") or {}
+        for variant in variant_names(app_config):
+            variant_reasons = list(reasons)
+            key = variant or state_store.UNIVERSAL
+            if locked and built.get(key) != config_digest(app_config, rules, variant):
+                variant_reasons.append("config changed" if key in built else "no recorded build")
+            if assets is not None:
+                missing = match_artifact(app_config, variant, assets) is None
+            else:
+                missing = find_artifact(app_config, variant, rules.output_dir) is None
+            if missing:
+                variant_reasons.append("no artifact")
+            if variant_reasons:
+                entries.append({"app": app_name, "variant": variant or "", "reason": "; ".join(variant_reasons)})
+    return entries
+
+def build_records(app_name, variants=None, patch_release=None) -> list:
+    """The state_store.record_build() arguments for a successful build, one dict per variant"""
+    rules = config.load_build_rules()
+    app_config = config.load_app(app_name)
+    apk = resolve_apk_version(app_config)
+    if patch_release is None and app_config.patches.source:
+        patch_release = version_check.get_patch_version(app_config.patches.source)
+
+    records = []
+    for variant in variants or variant_names(app_config):
+        artifact = find_artifact(app_config, variant, rules.output_dir)
+        records.append({
+            "app": app_name, "variant": variant, "inputs": config_digest(app_config, rules, variant),
+            "apk_version": apk, "patch_version": patch_release or "latest",
+            "artifact": str(artifact) if artifact else None,
+            "sha256": stage_cache.file_digest(artifact) if artifact else None,
+            "size": artifact.stat().st_size if artifact else None,
+        })
+    return records
+
+def record(app_name, variants=None, patch_release=None, output=None):
+    """Store a successful build in the state store and versions.lock, or in the JSON file output"""
+    records = build_records(app_name, variants, patch_release)
+    if output:
+        output = Path(output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        existing = json.loads(output.read_text()) if output.exists() else []
+        output.write_text(json.dumps(existing + records, indent=2))
+        return
+    apply_records(records)
+
+def apply_records(records):
+    """Store build records in one state store pass, then rewrite versions.lock"""
+    for entry in records:
+        state_store.store.record_build(**entry)
+    state_store.store.export_lock()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan which apps and variants need building")
+    parser.add_argument("--app", action="append", help="App identifier (repeatable; default: all apps)")
+    parser.add_argument("--force", action="append", default=[], help="Build this app regardless of state (repeatable)")
+    parser.add_argument("--patch-release", help="Patch release tag (default: resolved from patches.source)")
+    parser.add_argument("--record", action="store_true", help="Record a finished build of --app in versions.lock")
+    parser.add_argument("--variant", action="append", help="With --record, only record these variants")
+    parser.add_argument("--record-file", help="With --record, write the records to this JSON file instead")
+    parser.add_argument("--apply", nargs="+", metavar="FILE", help="Store records written with --record-file")
+    parser.add_argument("--assets", help="File listing published asset names, checked instead of output_dir")
+    parser.add_argument("--github-output", action="store_true", help="Append matrix=<json> to $GITHUB_OUTPUT")
+    args = parser.parse_args()
+
+    try:
+        if args.record:
+            if not args.app:
+                parser.error("--record needs --app")
+            for app_name in args.app:
+                record(app_name, args.variant, args.patch_release, args.record_file)
+            sys.exit(0)
+        if args.apply:
+            for path in args.apply:
+                with open(path) as f:
+                    apply_records(json.load(f))
+            sys.exit(0)
+        assets = Path(args.assets).read_text().split() if args.assets else None
+        entries = plan(args.app, args.patch_release, set(args.force), assets)
+    except config.ConfigError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    for entry in entries:
+        print(f"{entry['app']}{':' + entry['variant'] if entry['variant'] else ''}: {entry['reason']}", file=sys.stderr)
+    if not entries:
+        print("Nothing to build", file=sys.stderr)
+    if args.github_output:
+        with open(os.environ["GITHUB_OUTPUT"], "a") as f:
+            f.write(f"matrix={json.dumps(entries)}\n")
+    else:
+        print(json.dumps(entries, indent=2))
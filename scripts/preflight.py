@@ -0,0 +1,111 @@
+"""Fail-fast validation of app configs against the patch index.
+
+Runs before anything is downloaded: every name in patches.include and
+patches.exclude must exist in patches.json, included patches must support
+the app's package and the version that would be downloaded, and the package
+must be targeted by at least one patch. All problems across all apps are
+reported together so a single run shows everything that needs fixing.
+"""
+import argparse
+import difflib
+import sys
+import config
+import patch_index
+import planner
+
+def check_app(app_config, index, version=None):
+    """Return (errors, warnings) for one app config"""
+    errors, warnings = [], []
+    package = app_config.package
+    patches = app_config.patches
+
+    targeted = package in index["packages"] or any(
+        patch["packages"] is None for patch in index["patches"].values()
+    )
+    if not targeted:
+        errors.append(f"No patch in patches.json supports {package}")
+
+    supported = patch_index.get_versions(index, package)
+    if config.is_pinned(version) and supported and version not in supported:
+        errors.append(f"{package} {version} is not supported by any patch (latest supported: {supported[-1]})")
+
+    for kind in ("include", "exclude"):
+        for name in getattr(patches, kind):
+            patch = patch_index.get_patch(index, name)
+            if patch is None:
+                errors.append(f"Unknown patch in {kind}: {name!r}{_suggestion(name, index)}")
+                continue
+            problem = _incompatibility(patch, package, version)
+            if not problem:
+                continue
+            # Excluding a patch that would not apply anyway is harmless
+            (errors if kind == "include" else warnings).append(f"Patch {name!r} in {kind} {problem}")
+
+    return errors, warnings
+
+def preflight(app_names):
+    """Check the given apps against the local patches.json; returns True if all pass"""
+    index = patch_index.load_local_index()
+    if index is None:
+        print("Preflight failed: no valid local patches.json to check against")
+        return False
+
+    ok = True
+    for app_name in app_names:
+        try:
+            app_config = config.load_app(app_name)
+            version = resolve_version(app_config)
+        except RuntimeError as e:
+            print(f"{app_name}: error: {e}")
+            ok = False
+            continue
+
+        errors, warnings = check_app(app_config, index, version)
+        for warning in warnings:
+            print(f"{app_name}: warning: {warning}")
+        for error in errors:
+            print(f"{app_name}: error: {error}")
+        if errors:
+            ok = False
+        else:
+            print(f"{app_name}: preflight passed ({app_config.package} {version})")
+    return ok
+
+def resolve_version(app_config):
+    """The release a build would download, resolving channels such as latest upstream"""
+    version = planner.resolve_apk_version(app_config)
+    if not config.is_pinned(version):
+        source = app_config.source
+        if not source.url or "{version}" in source.url:
+            raise RuntimeError(f"could not resolve version {version!r} to an upstream release")
+        print(f"{app_config.package}: warning: {source.url} serves an unversioned download; version checks skipped")
+    return version
+
+def _incompatibility(patch, package, version):
+    compat = patch["packages"]
+    if compat is None:
+        return None
+    if package not in compat:
+        return f"does not support {package}"
+    versions = compat[package]
+    if versions and config.is_pinned(version) and version not in versions:
+        return f"does not support {package} {version}"
+    return None
+
+def _suggestion(name, index):
+    matches = difflib.get_close_matches(name, list(index["patches"]), n=1)
+    return f" (did you mean {matches[0]!r}?)" if matches else ""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate app patch configs against patches.json")
+    parser.add_argument("--app", action="append", help="App identifier (repeatable)")
+    parser.add_argument("--all", action="store_true", help="Check every app in configs/apps")
+    args = parser.parse_args()
+
+    apps = args.app or []
+    if args.all:
+        apps = config.app_names()
+    if not apps:
+        parser.error("Specify --app or --all")
+
+    sys.exit(0 if preflight(apps) else 1)
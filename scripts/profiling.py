@@ -0,0 +1,195 @@
+"""Per-stage timing and child-process resource instrumentation.
+
+profiler.stage() records wall time, CPU time, peak RSS, bytes read and
+written and the temp-disk high-water mark for a block of work.
+record_process() attributes a child's rusage, reaped by runner.run, to the
+current stage. write_reports() emits a JSON report and a Prometheus textfile.
+"""
+import contextlib
+import json
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+REPORT_DIR = Path("reports")
+METRIC_PREFIX = "autorevanced"
+SAMPLE_INTERVAL = 0.5
+BLOCK_SIZE = 512  # ru_inblock/ru_oublock are counted in 512-byte blocks
+
+class Profiler:
+    """Collects stage and child-process measurements for one run"""
+
+    def __init__(self):
+        self.stages = []
+        self.processes = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.active = {}
+        self.temp_baseline = None
+        self.sampler = None
+
+    @contextlib.contextmanager
+    def stage(self, name, **labels):
+        """Measure a block of work as a named stage"""
+        record = {
+            "stage": name,
+            "labels": labels,
+            "wall_seconds": 0.0,
+            "cpu_seconds": 0.0,
+            "peak_rss_bytes": 0,
+            "read_bytes": 0,
+            "written_bytes": 0,
+            "temp_disk_peak_bytes": 0,
+            "processes": 0,
+            "status": "ok",
+        }
+        self._start_sampler()
+        parent = getattr(self.local, "record", None)
+        self.local.record = record
+        with self.lock:
+            self.active[id(record)] = record
+
+        start = time.monotonic()
+        cpu_start = _thread_cpu()
+        io_start = _thread_io()
+        try:
+            yield record
+        except BaseException:
+            record["status"] = "failed"
+            raise
+        finally:
+            record["wall_seconds"] += time.monotonic() - start
+            record["cpu_seconds"] += _thread_cpu() - cpu_start
+            io_end = _thread_io()
+            record["read_bytes"] += io_end[0] - io_start[0]
+            record["written_bytes"] += io_end[1] - io_start[1]
+            record["peak_rss_bytes"] = max(record["peak_rss_bytes"], _self_maxrss())
+            self.local.record = parent
+            with self.lock:
+                self.active.pop(id(record), None)
+                self.stages.append(record)
+
+    def record_process(self, cmd, wall, rusage, returncode):
+        """Attribute a reaped child's rusage to the current stage"""
+        record = getattr(self.local, "record", None)
+        process = {
+            "stage": record["stage"] if record else None,
+            "command": Path(cmd[0]).name if cmd else "",
+            "args": [str(c) for c in cmd],
+            "returncode": returncode,
+            "wall_seconds": wall,
+            "cpu_seconds": rusage.ru_utime + rusage.ru_stime,
+            "peak_rss_bytes": rusage.ru_maxrss * 1024,
+            "read_bytes": rusage.ru_inblock * BLOCK_SIZE,
+            "written_bytes": rusage.ru_oublock * BLOCK_SIZE,
+        }
+        with self.lock:
+            self.processes.append(process)
+            if record:
+                record["processes"] += 1
+                record["cpu_seconds"] += process["cpu_seconds"]
+                record["read_bytes"] += process["read_bytes"]
+                record["written_bytes"] += process["written_bytes"]
+                record["peak_rss_bytes"] = max(record["peak_rss_bytes"], process["peak_rss_bytes"])
+        return process
+
+    def report(self):
+        with self.lock:
+            return {
+                "generated": time.time(),
+                "stages": list(self.stages),
+                "processes": list(self.processes),
+            }
+
+    def write_reports(self, json_path=None, prom_path=None):
+        """Write the JSON report and Prometheus textfile, returning their paths"""
+        json_path = Path(json_path or REPORT_DIR / "profile.json")
+        prom_path = Path(prom_path or REPORT_DIR / "profile.prom")
+        report = self.report()
+
+        json_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+        prom_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = prom_path.with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
+            f.write(format_prometheus(report))
+        os.replace(tmp_file, prom_path)  # node_exporter must never see a partial file
+        return json_path, prom_path
+
+    def _start_sampler(self):
+        with self.lock:
+            if self.sampler is not None:
+                return
+            self.temp_baseline = _temp_usage()
+            self.sampler = threading.Thread(target=self._sample_temp, daemon=True)
+            self.sampler.start()
+
+    def _sample_temp(self):
+        while True:
+            used = max(0, _temp_usage() - self.temp_baseline)
+            with self.lock:
+                for record in self.active.values():
+                    record["temp_disk_peak_bytes"] = max(record["temp_disk_peak_bytes"], used)
+            time.sleep(SAMPLE_INTERVAL)
+
+profiler = Profiler()
+
+def stage(name, **labels):
+    """Measure a block of work with the process-wide profiler"""
+    return profiler.stage(name, **labels)
+
+def format_prometheus(report):
+    """Render a report in the Prometheus textfile exposition format"""
+    metrics = [
+        ("wall_seconds", "Wall-clock time"),
+        ("cpu_seconds", "User plus system CPU time"),
+        ("peak_rss_bytes", "Peak resident set size"),
+        ("read_bytes", "Bytes read from storage"),
+        ("written_bytes", "Bytes written to storage"),
+    ]
+    lines = []
+    for kind, rows in (("stage", report["stages"]), ("process", report["processes"])):
+        kind_metrics = metrics + ([("temp_disk_peak_bytes", "Temp disk high-water mark")] if kind == "stage" else [])
+        for metric, help_text in kind_metrics:
+            name = f"{METRIC_PREFIX}_{kind}_{metric}"
+            lines.append(f"# HELP {name} {help_text} per pipeline {kind}")
+            lines.append(f"# TYPE {name} gauge")
+            for seq, row in enumerate(rows):
+                labels = _labels(row, kind, seq)
+                lines.append(f"{name}{{{labels}}} {row[metric]}")
+    return "\n".join(lines) + "\n"
+
+def _labels(row, kind, seq):
+    # seq keeps series unique when a stage or command runs more than once
+    if kind == "stage":
+        labels = {"stage": row["stage"], "seq": seq, **row["labels"]}
+    else:
+        labels = {"stage": row["stage"] or "", "command": row["command"], "seq": seq}
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _thread_cpu():
+    return time.thread_time()
+
+def _thread_io():
+    """(read_bytes, write_bytes) of the calling thread from /proc, or zeros"""
+    try:
+        with open(f"/proc/self/task/{threading.get_native_id()}/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["read_bytes"]), int(fields["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+def _self_maxrss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _temp_usage():
+    return shutil.disk_usage(tempfile.gettempdir()).used
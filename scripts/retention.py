@@ -0,0 +1,130 @@
+"""Retention and garbage collection for downloads, dist and temp trees.
+
+Enforces build_rules.yaml: artifacts in downloads/ and output_dir older than
+retention_days are removed, then the least recently used ones until both
+fit in retention_max_mb. The newest artifact of every configured app in each
+directory is always kept. _merged intermediates are removed outright, and
+apkeditor_*/revanced_* temp trees left by crashed runs are removed once they
+are older than temp_max_age_hours.
+"""
+import argparse
+import shutil
+import tempfile
+import time
+from pathlib import Path
+import config
+
+DOWNLOAD_DIR = Path("downloads")
+TEMP_PREFIXES = ("apkeditor_", "revanced_")
+
+def load_policy():
+    """Retention settings from build_rules.yaml"""
+    rules = config.load_build_rules()
+    return {
+        "dirs": [DOWNLOAD_DIR, Path(rules.output_dir)],
+        "retention_days": rules.retention_days,
+        "max_bytes": rules.retention_max_mb * 1024 * 1024,
+        "temp_max_age_hours": rules.temp_max_age_hours,
+    }
+
+def configured_packages():
+    """Package names of every app config, longest first for prefix matching"""
+    packages = [app.package for app in config.load_apps().values()]
+    return sorted(packages, key=len, reverse=True)
+
+def owner(path, packages):
+    """The configured package an artifact belongs to, or None"""
+    return next((pkg for pkg in packages if path.name.startswith(pkg)), None)
+
+def scan(dirs, packages, skip=()):
+    """(last used, size, path, protected) for every artifact in dirs not in skip"""
+    artifacts = []
+    for directory in dirs:
+        newest = {}
+        entries = []
+        for path in Path(directory).glob("*"):
+            if not path.is_file() or str(path) in skip:
+                continue
+            stat = path.stat()
+            used = max(stat.st_atime, stat.st_mtime)
+            package = owner(path, packages)
+            entries.append((used, stat.st_size, path, package))
+            if package and used > newest.get(package, (0, None))[0]:
+                newest[package] = (used, path)
+        protected = {path for _, path in newest.values()}
+        artifacts.extend((used, size, path, path in protected) for used, size, path, _ in entries)
+    return artifacts
+
+def collect(policy=None, dry_run=False, now=None):
+    """Apply the retention policy; returns a summary of what was (or would be) removed"""
+    policy = policy or load_policy()
+    now = now or time.time()
+    removed = []
+
+    def remove(path, size, reason):
+        removed.append({"path": str(path), "bytes": size, "reason": reason})
+        if dry_run:
+            return
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+
+    # Merge intermediates are never reused once the optimized APK exists
+    for path in DOWNLOAD_DIR.glob("*_merged.*"):
+        if path.is_file():
+            remove(path, path.stat().st_size, "merge intermediate")
+
+    artifacts = scan(policy["dirs"], configured_packages(), skip={item["path"] for item in removed})
+
+    cutoff = now - policy["retention_days"] * 86400
+    kept = []
+    for used, size, path, protected in sorted(artifacts):
+        if used < cutoff and not protected:
+            remove(path, size, f"older than {policy['retention_days']} days")
+        else:
+            kept.append((used, size, path, protected))
+
+    total = sum(size for _, size, _, _ in kept)
+    for used, size, path, protected in kept:
+        if total <= policy["max_bytes"]:
+            break
+        if protected:
+            continue
+        remove(path, size, "over size budget")
+        total -= size
+
+    temp_cutoff = now - policy["temp_max_age_hours"] * 3600
+    for path in Path(tempfile.gettempdir()).iterdir():
+        if path.name.startswith(TEMP_PREFIXES) and path.is_dir():
+            try:
+                if path.stat().st_mtime < temp_cutoff:
+                    remove(path, _tree_size(path), "stale temp tree")
+            except FileNotFoundError:
+                continue
+
+    return {"removed": removed, "freed_bytes": sum(r["bytes"] for r in removed), "kept_bytes": total}
+
+def _tree_size(path):
+    total = 0
+    for f in path.rglob("*"):
+        try:
+            if f.is_file():
+                total += f.stat().st_size
+        except OSError:
+            continue
+    return total
+
+def print_summary(summary, dry_run=False):
+    verb = "Would remove" if dry_run else "Removed"
+    for item in summary["removed"]:
+        print(f"{verb} {item['path']} ({item['bytes']} bytes): {item['reason']}")
+    print(f"{verb} {len(summary['removed'])} item(s), {summary['freed_bytes']} bytes; "
+          f"{summary['kept_bytes']} bytes of artifacts kept")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evict old artifacts and stale temp trees")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be removed")
+    args = parser.parse_args()
+
+    print_summary(collect(dry_run=args.dry_run), args.dry_run)
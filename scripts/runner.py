@@ -0,0 +1,130 @@
+"""Streaming subprocess runner shared by every external tool call.
+
+Child stdout and stderr are merged and streamed line by line to the logger
+as they arrive, so a multi-megabyte JVM log is never held in memory; only a
+bounded tail is kept for error reports. Each command runs in its own process
+group and is killed as a group when its stage timeout (global.timeouts in
+build_rules.yaml) expires. The child is reaped with os.wait4 and its rusage
+is recorded against the current profiling stage.
+"""
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from pathlib import Path
+import config
+import profiling
+
+logger = logging.getLogger(__name__)
+
+TAIL_LINES = 200
+KILL_GRACE = 10  # Seconds between SIGTERM and SIGKILL
+
+class RunResult:
+    """Outcome of a command: exit status, output tail, rusage and timing"""
+    __slots__ = ("args", "returncode", "tail", "rusage", "wall_seconds", "timed_out")
+
+    def __init__(self, args, returncode, tail, rusage, wall_seconds, timed_out):
+        self.args = args
+        self.returncode = returncode
+        self.tail = tail
+        self.rusage = rusage
+        self.wall_seconds = wall_seconds
+        self.timed_out = timed_out
+
+    @property
+    def output(self):
+        """The last lines of combined stdout and stderr"""
+        return "\n".join(self.tail)
+
+def get_timeout(stage):
+    """Timeout in seconds for a stage from build_rules.yaml, or None for no limit"""
+    if not config.BUILD_RULES_FILE.exists():
+        return None
+    return config.load_build_rules().timeouts.get(stage)
+
+def available_memory_mb():
+    """MemAvailable from /proc/meminfo, falling back to total physical memory"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+
+def run(cmd, stage=None, timeout=None, tail_lines=TAIL_LINES, **kwargs):
+    """Run cmd, streaming its output to the log; returns a RunResult.
+
+    timeout defaults to the configured timeout for stage. On expiry the whole
+    process group gets SIGTERM, then SIGKILL after KILL_GRACE seconds.
+    """
+    if timeout is None and stage:
+        timeout = get_timeout(stage)
+    name = Path(str(cmd[0])).name
+    tail = deque(maxlen=tail_lines)
+
+    start = time.monotonic()
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        start_new_session=True,
+        **kwargs,
+    )
+    reader = threading.Thread(target=_pump, args=(proc.stdout, tail, name), daemon=True)
+    reader.start()
+
+    finished = threading.Event()
+    timed_out = threading.Event()
+    watchdog = None
+    if timeout:
+        watchdog = threading.Thread(target=_watchdog, args=(proc.pid, timeout, finished, timed_out), daemon=True)
+        watchdog.start()
+
+    try:
+        _, status, rusage = os.wait4(proc.pid, 0)
+    finally:
+        finished.set()
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.monotonic() - start
+
+    # Grandchildren may still hold the pipe open; take the rest of the group down with the leader
+    _signal_group(proc.pid, signal.SIGKILL)
+    reader.join()
+    proc.stdout.close()
+    if watchdog:
+        watchdog.join()
+
+    if timed_out.is_set():
+        message = f"{name} timed out after {timeout}s and was killed"
+        logger.error(message)
+        tail.append(message)
+
+    profiling.profiler.record_process(cmd, wall, rusage, proc.returncode)
+    return RunResult(cmd, proc.returncode, list(tail), rusage, wall, timed_out.is_set())
+
+def _pump(pipe, tail, name):
+    for raw in iter(pipe.readline, b""):
+        line = raw.decode(errors="replace").rstrip()
+        tail.append(line)
+        logger.info(f"[{name}] {line}")
+
+def _watchdog(pid, timeout, finished, timed_out):
+    if finished.wait(timeout):
+        return
+    timed_out.set()
+    _signal_group(pid, signal.SIGTERM)
+    if not finished.wait(KILL_GRACE):
+        _signal_group(pid, signal.SIGKILL)
+
+def _signal_group(pid, sig):
+    try:
+        os.killpg(pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
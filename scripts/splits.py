@@ -0,0 +1,163 @@
+"""Selective split extraction for APKS/XAPK/APKM bundles.
+
+Before a bundle is merged, each inner APK's binary AndroidManifest.xml is read
+straight from the container for its split name (config.arm64_v8a,
+config.xxhdpi, feature.config.en, ...). ABI config splits for architectures
+that will be stripped and density splits outside dpi.keep are dropped; the
+base, feature and language splits are always kept. The kept entries are
+raw-copied into a smaller container with ziputil, so the merge, decode and
+rebuild only ever see the bytes that survive into the final APK.
+"""
+import copy
+import json
+import re
+import struct
+import zipfile
+import zlib
+from pathlib import PurePosixPath
+import density
+import ziputil
+
+ABI_SPLITS = {"armeabi_v7a": "armeabi-v7a", "arm64_v8a": "arm64-v8a", "x86": "x86", "x86_64": "x86_64"}
+CONFIG_SPLIT_RE = re.compile(r"(?:^|\.)config\.([A-Za-z0-9_-]+)$")
+MANIFEST_FILES = ("manifest.json", "info.json")  # XAPK and APKM metadata
+
+RES_STRING_POOL_TYPE = 0x0001
+RES_XML_TYPE = 0x0003
+UTF8_FLAG = 0x100
+CHUNK_HEADER = struct.Struct("<HHL")
+STRING_POOL_HEADER = struct.Struct("<HHLLLLLL")
+
+def manifest_strings(axml: bytes) -> list:
+    """The string pool of a binary AndroidManifest.xml"""
+    chunk_type, header_size, _ = CHUNK_HEADER.unpack_from(axml)
+    if chunk_type != RES_XML_TYPE:
+        raise ValueError("Not a binary XML file")
+    (pool_type, _, _, count, _, flags, strings_start, _) = STRING_POOL_HEADER.unpack_from(axml, header_size)
+    if pool_type != RES_STRING_POOL_TYPE:
+        raise ValueError("Binary XML has no string pool")
+
+    pool = header_size
+    offsets = struct.unpack_from(f"<{count}L", axml, pool + STRING_POOL_HEADER.size)
+    base = pool + strings_start
+    strings = []
+    for offset in offsets:
+        pos = base + offset
+        if flags & UTF8_FLAG:
+            _, pos = _length8(axml, pos)  # UTF-16 length, unused
+            length, pos = _length8(axml, pos)
+            strings.append(axml[pos:pos + length].decode("utf-8", errors="replace"))
+        else:
+            length, pos = _length16(axml, pos)
+            strings.append(axml[pos:pos + length * 2].decode("utf-16-le", errors="replace"))
+    return strings
+
+def split_qualifier(axml: bytes) -> str | None:
+    """The config qualifier of a config split (e.g. arm64_v8a, xxhdpi, en), or None"""
+    for string in manifest_strings(axml):
+        match = CONFIG_SPLIT_RE.search(string)
+        if match:
+            return match.group(1)
+    return None
+
+def classify(qualifier):
+    """("abi", arch), ("density", bucket) or ("other", qualifier) for a config qualifier"""
+    if qualifier in ABI_SPLITS:
+        return "abi", ABI_SPLITS[qualifier]
+    if qualifier.endswith("dpi") and density.density_value(qualifier) is not None:
+        return "density", qualifier
+    return "other", qualifier
+
+def select(input_path, output_path, archs, keep_dpis):
+    """Copy input_path to output_path without unwanted ABI and density splits.
+
+    archs are the architectures the build keeps; keep_dpis is dpi.keep (empty
+    keeps every density). If no density split matches, all of them are kept
+    so no resources go missing. Returns (kept split names, dropped split names).
+    """
+    with zipfile.ZipFile(input_path) as zf:
+        entries = ziputil.read_entries(zf)
+        splits = {}
+        for entry in entries:
+            if entry.filename.lower().endswith(".apk"):
+                splits[entry.filename] = _read_qualifier(zf, entry)
+
+        kinds = {name: classify(q) if q else ("base", None) for name, q in splits.items()}
+        densities = [value for kind, value in kinds.values() if kind == "density"]
+        filter_density = keep_dpis and any(density.keeps_density(d, keep_dpis) for d in densities)
+
+        dropped = set()
+        for name, (kind, value) in kinds.items():
+            if kind == "abi" and value not in archs:
+                dropped.add(name)
+            elif kind == "density" and filter_density and not density.keeps_density(value, keep_dpis):
+                dropped.add(name)
+        if splits and dropped == set(splits):
+            raise RuntimeError(f"Split selection would drop every APK in {input_path}")
+
+        with open(output_path, "wb") as out:
+            writer = ziputil.RawZipWriter(out)
+            for entry in entries:
+                if entry.filename in dropped:
+                    continue
+                if PurePosixPath(entry.filename).name in MANIFEST_FILES:
+                    data = _prune_metadata(zf.read(entry.info), dropped)
+                    if data is not None:
+                        writer.add_data(_replaced(entry, data), data, zipfile.ZIP_STORED)
+                        continue
+                writer.add_raw(entry, zf.fp)
+            writer.close()
+
+    kept = sorted(set(splits) - dropped)
+    return kept, sorted(dropped)
+
+def _read_qualifier(zf, entry):
+    try:
+        with zf.open(entry.info) as inner, zipfile.ZipFile(inner) as apk:
+            return split_qualifier(apk.read("AndroidManifest.xml"))
+    except (KeyError, ValueError, struct.error, zipfile.BadZipFile):
+        return None  # Unreadable manifests are kept like the base
+
+def _prune_metadata(data, dropped):
+    """Drop removed splits from an XAPK/APKM metadata file, or None to copy it unchanged"""
+    try:
+        meta = json.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(meta, dict):
+        return None
+    names = {PurePosixPath(name).name for name in dropped}
+    ids = {name.rsplit(".", 1)[0] for name in names}
+    changed = False
+    if isinstance(meta.get("split_apks"), list):
+        split_apks = [s for s in meta["split_apks"] if not (isinstance(s, dict) and s.get("file") in names)]
+        changed |= len(split_apks) != len(meta["split_apks"])
+        meta["split_apks"] = split_apks
+    if isinstance(meta.get("split_configs"), list):
+        split_configs = [s for s in meta["split_configs"] if s not in ids and f"split_{s}" not in ids]
+        changed |= len(split_configs) != len(meta["split_configs"])
+        meta["split_configs"] = split_configs
+    return json.dumps(meta, indent=2).encode() if changed else None
+
+def _replaced(entry, data):
+    """A copy of entry describing data stored uncompressed"""
+    entry = copy.copy(entry)
+    entry.info = copy.copy(entry.info)
+    entry.info.CRC = zlib.crc32(data)
+    entry.info.file_size = len(data)
+    entry.info.compress_size = len(data)
+    entry.flags &= ~ziputil.DATA_DESCRIPTOR_FLAG
+    return entry
+
+def _length8(data, pos):
+    length = data[pos]
+    if length & 0x80:
+        return ((length & 0x7F) << 8) | data[pos + 1], pos + 2
+    return length, pos + 1
+
+def _length16(data, pos):
+    (length,) = struct.unpack_from("<H", data, pos)
+    if length & 0x8000:
+        (low,) = struct.unpack_from("<H", data, pos + 2)
+        return ((length & 0x7FFF) << 16) | low, pos + 4
+    return length, pos + 2
@@ -0,0 +1,140 @@
+"""Content-addressed cache for pipeline stage outputs.
+
+Each stage (merge, optimize, patch) is keyed by the SHA-256 of its exact
+inputs: the input artifact, the tool jars, the config files it reads and any
+parameters. Outputs are stored once under .cache/stages/objects by their own
+digest and keys/<key> points at the object, so a repeat run with identical
+inputs materializes the previous artifact instead of starting a JVM.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+STORE_DIR = Path(".cache/stages")
+MAX_STORE_BYTES = 4 * 1024 * 1024 * 1024
+STAGE_CACHE_VERSION = 1
+
+# In-process memo of file digests keyed by (path, mtime, size)
+_digests = {}
+_digests_lock = threading.Lock()
+
+def file_digest(path) -> str | None:
+    """SHA-256 of a file, or None if it does not exist"""
+    path = Path(path)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+
+    key = (str(path.resolve()), stat.st_mtime_ns, stat.st_size)
+    with _digests_lock:
+        if key in _digests:
+            return _digests[key]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    digest = digest.hexdigest()
+
+    with _digests_lock:
+        _digests[key] = digest
+    return digest
+
+def stage_key(stage, inputs, params=None) -> str:
+    """Hash a stage name, its input files (by content) and parameters into a cache key"""
+    material = {
+        "stage": stage,
+        "version": STAGE_CACHE_VERSION,
+        "inputs": [[Path(p).name, file_digest(p)] for p in inputs],
+        "params": params or {},
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode()).hexdigest()
+
+def lookup(key, output_path) -> bool:
+    """Materialize the cached output for key at output_path, returning whether it was found"""
+    key_file = STORE_DIR / "keys" / key
+    try:
+        object_file = _object_path(key_file.read_text().strip())
+    except FileNotFoundError:
+        return False
+    if not object_file.exists():
+        key_file.unlink(missing_ok=True)  # Its object was evicted
+        return False
+
+    os.utime(object_file)  # Mark as recently used for eviction
+    _materialize(object_file, Path(output_path))
+    return True
+
+def store(key, output_path):
+    """Add a stage output to the store and point key at it"""
+    digest = file_digest(output_path)
+    object_file = _object_path(digest)
+    if not object_file.exists():
+        object_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = object_file.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        shutil.copyfile(output_path, tmp_file)
+        os.replace(tmp_file, object_file)
+
+    key_file = STORE_DIR / "keys" / key
+    key_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = key_file.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_file.write_text(digest)
+    os.replace(tmp_file, key_file)
+    evict()
+
+def run_cached(stage, inputs, params, output_path, produce):
+    """Run produce() unless an identical stage run is cached; return the output path"""
+    output_path = Path(output_path)
+    key = stage_key(stage, inputs, params)
+    if lookup(key, output_path):
+        print(f"Reusing cached {stage} output for {output_path.name}")
+        return output_path
+
+    # Never let a tool write through a hardlink into the store
+    output_path.unlink(missing_ok=True)
+    result = produce()
+    store(key, output_path)
+    return result if result is not None else output_path
+
+def evict(max_bytes=MAX_STORE_BYTES):
+    """Drop least recently used objects, and the keys pointing at them, until the store fits in max_bytes"""
+    objects = []
+    for object_file in (STORE_DIR / "objects").glob("*/*"):
+        try:
+            stat = object_file.stat()
+        except FileNotFoundError:
+            continue
+        objects.append((stat.st_mtime, stat.st_size, object_file))
+
+    total = sum(size for _, size, _ in objects)
+    evicted = set()
+    for _, size, object_file in sorted(objects):
+        if total <= max_bytes:
+            break
+        object_file.unlink(missing_ok=True)
+        evicted.add(object_file.name)
+        total -= size
+
+    if evicted:
+        for key_file in (STORE_DIR / "keys").glob("*"):
+            try:
+                if key_file.read_text().strip() in evicted:
+                    key_file.unlink(missing_ok=True)
+            except FileNotFoundError:
+                continue
+
+def _object_path(digest):
+    return STORE_DIR / "objects" / digest[:2] / digest
+
+def _materialize(object_file, output_path):
+    """Hardlink the object into place, falling back to a copy across filesystems"""
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.unlink(missing_ok=True)
+    try:
+        os.link(object_file, output_path)
+    except OSError:
+        shutil.copyfile(object_file, output_path)
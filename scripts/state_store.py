@@ -0,0 +1,259 @@
+"""SQLite store for version state and build history.
+
+Replaces whole-file rewrites of versions.lock and versions.json with
+transactional upserts into .cache/state.db:
+
+  apps       current APK and patch version per app, with check timestamps
+  variants   inputs digest and versions of the last build per app variant
+  checks     every update check result (history)
+  artifacts  every built artifact with its SHA-256 and size (history)
+
+Timestamps are UTC ISO-8601 strings, so they compare correctly as text and
+"what changed since X" is an indexed range query. versions.lock and
+versions.json are still written from the store for the workflow and older
+tools, and an existing versions.lock is imported into an empty store.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, UTC
+from pathlib import Path
+import yaml
+
+DB_FILE = Path(".cache/state.db")
+LOCK_FILE = Path("versions.lock")
+UPDATES_FILE = Path("versions.json")
+UNIVERSAL = "universal"  # Variant key for apps built without variants
+UNRESOLVED_PATCHES = "latest"  # What checks report when they did not resolve a patch tag
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS apps (
+    app TEXT PRIMARY KEY,
+    apk_version TEXT,
+    patch_version TEXT,
+    last_checked TEXT,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS apps_updated ON apps (updated_at);
+CREATE TABLE IF NOT EXISTS variants (
+    app TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    inputs TEXT,
+    apk_version TEXT,
+    patch_version TEXT,
+    built_at TEXT NOT NULL,
+    PRIMARY KEY (app, variant)
+);
+CREATE TABLE IF NOT EXISTS checks (
+    id INTEGER PRIMARY KEY,
+    app TEXT NOT NULL,
+    apk_current TEXT,
+    apk_latest TEXT,
+    patch_current TEXT,
+    patch_latest TEXT,
+    checked_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS checks_time ON checks (checked_at);
+CREATE INDEX IF NOT EXISTS checks_app ON checks (app, checked_at);
+CREATE TABLE IF NOT EXISTS artifacts (
+    id INTEGER PRIMARY KEY,
+    app TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    path TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    apk_version TEXT,
+    patch_version TEXT,
+    built_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_app ON artifacts (app, variant, built_at);
+CREATE INDEX IF NOT EXISTS artifacts_sha ON artifacts (sha256);
+"""
+
+def now():
+    return datetime.now(UTC).isoformat()
+
+class StateStore:
+    """Transactional access to the state database; safe to share between threads"""
+
+    def __init__(self, path=DB_FILE, lock_file=LOCK_FILE):
+        self.path = Path(path)
+        self.lock_file = Path(lock_file)
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def connect(self):
+        """This thread's connection, creating the schema on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        with self._init_lock:
+            if not self._initialized:
+                with conn:
+                    conn.executescript(SCHEMA)
+                if conn.execute("SELECT COUNT(*) FROM apps").fetchone()[0] == 0 and self.lock_file.exists():
+                    self.import_lock(self.lock_file, conn)
+                self._initialized = True
+        return conn
+
+    def record_checks(self, checks):
+        """Add update check results to the history in one transaction.
+
+        checks holds (app, apk_current, apk_latest, patch_current, patch_latest,
+        checked_at) tuples; apk_latest is None when nothing newer was found.
+        """
+        with self.connect() as conn:
+            conn.executemany(
+                "INSERT INTO checks (app, apk_current, apk_latest, patch_current, patch_latest, checked_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)", checks)
+
+    def upsert_app(self, app, apk_version, patch_version, checked_at=None):
+        """Set an app's current versions; updated_at only moves when a version changes.
+
+        A patch_version of None or "latest" keeps the recorded patch tag.
+        """
+        with self.connect() as conn:
+            _upsert_app(conn, app, apk_version, patch_version, checked_at or now())
+
+    def record_updates(self, updates):
+        """Apply check_updates() results (app -> {apk, patch, updated}) in one transaction"""
+        with self.connect() as conn:
+            for app, data in updates.items():
+                _upsert_app(conn, app, data['apk']['latest'], data['patch']['latest'], data['updated'])
+
+    def record_build(self, app, variant, inputs, apk_version, patch_version, artifact=None, sha256=None, size=None):
+        """Record a finished build of one variant and, optionally, its artifact"""
+        built_at = now()
+        variant = variant or UNIVERSAL
+        with self.connect() as conn:
+            _upsert_app(conn, app, apk_version, patch_version, built_at)
+            conn.execute(
+                "INSERT INTO variants (app, variant, inputs, apk_version, patch_version, built_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (app, variant) DO UPDATE SET inputs = excluded.inputs,"
+                "  apk_version = excluded.apk_version, patch_version = excluded.patch_version,"
+                "  built_at = excluded.built_at",
+                (app, variant, inputs, apk_version, patch_version, built_at))
+            if artifact is not None:
+                conn.execute(
+                    "INSERT INTO artifacts (app, variant, path, sha256, size, apk_version, patch_version, built_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (app, variant, str(artifact), sha256, size if size is not None else Path(artifact).stat().st_size,
+                     apk_version, patch_version, built_at))
+
+    def changed_since(self, since) -> list:
+        """Apps whose APK or patch version changed at or after since, oldest first"""
+        rows = self.connect().execute(
+            "SELECT app, apk_version, patch_version, updated_at FROM apps"
+            " WHERE updated_at >= ? ORDER BY updated_at", (since,))
+        return [dict(row) for row in rows]
+
+    def checks_since(self, since) -> list:
+        """Check results recorded at or after since, oldest first"""
+        rows = self.connect().execute(
+            "SELECT * FROM checks WHERE checked_at >= ? ORDER BY checked_at, id", (since,))
+        return [dict(row) for row in rows]
+
+    def history(self, app, limit=20) -> list:
+        """The most recent artifacts built for an app"""
+        rows = self.connect().execute(
+            "SELECT variant, path, sha256, size, apk_version, patch_version, built_at FROM artifacts"
+            " WHERE app = ? ORDER BY built_at DESC, id DESC LIMIT ?", (app, limit))
+        return [dict(row) for row in rows]
+
+    def lock(self) -> dict:
+        """The state in versions.lock's format"""
+        conn = self.connect()
+        lock = {}
+        for row in conn.execute("SELECT * FROM apps ORDER BY app"):
+            lock[row['app']] = {
+                'apk_version': f"{row['apk_version'] or ''} {row['patch_version'] or UNRESOLVED_PATCHES}",
+                'last_checked': row['last_checked'],
+            }
+        for row in conn.execute("SELECT app, variant, inputs FROM variants WHERE inputs IS NOT NULL ORDER BY app, variant"):
+            lock.setdefault(row['app'], {}).setdefault('inputs', {})[row['variant']] = row['inputs']
+        return lock
+
+    def export_lock(self, path=None):
+        """Write versions.lock from the store"""
+        _write_atomic(path or self.lock_file, yaml.safe_dump(self.lock(), default_flow_style=False))
+
+    def export_updates(self, path=UPDATES_FILE, since=None):
+        """Write versions.json (the check_updates() format) from checks since the given time"""
+        updates = {}
+        for row in self.checks_since(since or ""):
+            if row['apk_latest'] is None or (row['apk_current'] == row['apk_latest']
+                                             and row['patch_current'] == row['patch_latest']):
+                continue
+            updates[row['app']] = {
+                'apk': {'current': row['apk_current'], 'latest': row['apk_latest']},
+                'patch': {'current': row['patch_current'], 'latest': row['patch_latest']},
+                'updated': row['checked_at'],
+            }
+        _write_atomic(path, json.dumps(updates))
+        return updates
+
+    def import_lock(self, path=None, conn=None):
+        """Load a versions.lock file into the store"""
+        with open(path or self.lock_file) as f:
+            lock = yaml.safe_load(f) or {}
+        with (conn or self.connect()) as conn:
+            for app, entry in lock.items():
+                entry = entry or {}
+                apk, _, patches = str(entry.get('apk_version', '')).partition(' ')
+                checked = str(entry.get('last_checked') or now())
+                _upsert_app(conn, app, apk or None, patches or None, checked)
+                for variant, inputs in (entry.get('inputs') or {}).items():
+                    conn.execute(
+                        "INSERT OR REPLACE INTO variants (app, variant, inputs, apk_version, patch_version, built_at)"
+                        " VALUES (?, ?, ?, ?, ?, ?)", (app, variant, inputs, apk or None, patches or None, checked))
+
+def _upsert_app(conn, app, apk_version, patch_version, checked_at):
+    if patch_version == UNRESOLVED_PATCHES:
+        patch_version = None  # Not a tag; never overwrite a real one with it
+    conn.execute(
+        "INSERT INTO apps (app, apk_version, patch_version, last_checked, updated_at) VALUES (?, ?, ?, ?, ?)"
+        " ON CONFLICT (app) DO UPDATE SET"
+        "  updated_at = CASE WHEN apk_version IS NOT excluded.apk_version"
+        "                      OR patch_version IS NOT COALESCE(excluded.patch_version, patch_version)"
+        "                    THEN excluded.updated_at ELSE updated_at END,"
+        "  apk_version = excluded.apk_version,"
+        "  patch_version = COALESCE(excluded.patch_version, patch_version),"
+        "  last_checked = excluded.last_checked",
+        (app, apk_version, patch_version, checked_at, checked_at))
+
+def _write_atomic(path, text):
+    path = Path(path)
+    tmp_file = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_file, "w") as f:
+        f.write(text)
+    os.replace(tmp_file, path)
+
+store = StateStore()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the version state store")
+    parser.add_argument("--since", help="List apps whose version changed since this ISO timestamp")
+    parser.add_argument("--history", metavar="APP", help="List recent artifacts built for an app")
+    parser.add_argument("--export", action="store_true", help="Rewrite versions.lock from the store")
+    args = parser.parse_args()
+
+    if args.since:
+        for row in store.changed_since(args.since):
+            print(f"{row['updated_at']}  {row['app']}: {row['apk_version']} (patches {row['patch_version']})")
+    if args.history:
+        for row in store.history(args.history):
+            print(f"{row['built_at']}  {row['variant']}: {row['path']} {row['sha256'][:12]} {row['size']} bytes")
+    if args.export:
+        store.export_lock()
+        print(f"Wrote {store.lock_file}")
+    if not (args.since or args.history or args.export):
+        print(yaml.safe_dump(store.lock(), default_flow_style=False), end="")
@@ -1,19 +1,31 @@
-import yaml
 import requests
 from datetime import datetime, UTC
 from pathlib import Path
-import json
+from urllib.parse import urlsplit
 import logging
 import argparse
+import json
 import sys
-from natsort import natsorted
+import os
+from concurrent.futures import ThreadPoolExecutor
+import config
+import fetch
+import http_cache
+import patch_index
+import state_store
 
 logger = logging.getLogger(__name__)
 
-def get_latest_version(org, repo):
-    url = f"https://api.apkmirror.com/v2/apps/{org}/{repo}/"
+APKMIRROR_API_URL = os.environ.get("APKMIRROR_API_URL", "https://api.apkmirror.com/v2")
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+CHECK_WORKERS = 8
+PATCH_FILES = {"patches.json": "patches.json", ".rvp": "patches.rvp"}  # Asset name or suffix -> local file
+PATCH_FILES_STATE = Path(".cache/patches_release.json")
+
+def get_latest_version(org, repo, max_age=None):
+    url = f"{APKMIRROR_API_URL}/apps/{org}/{repo}/"
     try:
-        response = requests.get(url, timeout=10)
+        response = http_cache.cached_get(url, max_age)
         response.raise_for_status()
         json_data = response.json()
         version = json_data.get('data', {}).get('version')
@@ -25,67 +37,83 @@ def get_latest_version(org, repo):
         logger.error(f"Failed to fetch latest version from {url}: {e}")
         return None
 
-def get_patch_version(patch_url):
-    response = requests.get(patch_url)
-    return response.url.split('/')[-2]  # Extract version from release URL
+def patch_releases_api(patch_url):
+    """GitHub releases API URL for a patches.source like https://github.com/<owner>/<repo>/releases/latest"""
+    url = urlsplit(patch_url)
+    parts = url.path.strip('/').split('/')
+    if url.netloc != "github.com" or len(parts) < 2:
+        return None
+    return f"{GITHUB_API_URL}/repos/{parts[0]}/{parts[1]}/releases"
 
-def get_compatible_versions(package_name):
-    """Get compatible versions for a package from patches.json"""
+def get_patch_release(patch_url, max_age=None):
+    """(tag, {asset name: download URL}) of the newest published patches release, or None"""
+    api_url = patch_releases_api(patch_url)
+    if api_url is None:
+        return None
     try:
-        # First try patches.json in current directory
-        patches_file = Path("patches.json")
-        if not patches_file.exists():
-            patches_file = Path("patches.json")
-        
-        logger.debug(f"Trying to read from: {patches_file.absolute()}")
-        if not patches_file.exists():
+        response = http_cache.cached_get(api_url, max_age)
+        response.raise_for_status()
+        releases = response.json()
+    except (requests.RequestException, ValueError) as e:
+        logger.error(f"Failed to fetch patch releases from {api_url}: {e}")
+        return None
+    # Same choice as the workflow: the first release that is neither a draft nor a prerelease
+    for release in releases:
+        if not (release.get('draft') or release.get('prerelease')):
+            return release['tag_name'], {a['name']: a['browser_download_url'] for a in release.get('assets', [])}
+    return None
+
+def get_patch_version(patch_url, max_age=None):
+    release = get_patch_release(patch_url, max_age)
+    if release:
+        return release[0]
+    response = http_cache.cached_get(patch_url, max_age)
+    return response.url.rstrip('/').split('/')[-1]  # Tag from the .../releases/tag/<tag> redirect
+
+def refresh_patch_files(patch_url, max_age=None):
+    """Download patches.json and patches.rvp of the newest patches release if its tag changed.
+
+    Returns the release tag, or None if it could not be resolved.
+    """
+    release = get_patch_release(patch_url, max_age)
+    if release is None:
+        return None
+    tag, assets = release
+    try:
+        current = json.loads(PATCH_FILES_STATE.read_text()).get('tag')
+    except (FileNotFoundError, ValueError):
+        current = None
+    if current == tag and all(Path(dest).exists() for dest in PATCH_FILES.values()):
+        return tag
+
+    downloads = {}
+    for asset, dest in PATCH_FILES.items():
+        url = assets.get(asset) or next((u for name, u in assets.items() if name.endswith(asset)), None)
+        if url is None:
+            logger.error(f"Patches release {tag} has no {asset} asset")
+            return None
+        downloads[dest] = url
+    for dest, url in downloads.items():
+        fetch.fetch(url, dest)
+    PATCH_FILES_STATE.parent.mkdir(parents=True, exist_ok=True)
+    PATCH_FILES_STATE.write_text(json.dumps({'tag': tag, 'refreshed': datetime.now(UTC).isoformat()}))
+    logger.info(f"Refreshed {', '.join(downloads)} to patches release {tag}")
+    return tag
+
+def get_compatible_versions(package_name, index=None):
+    """Get compatible versions for a package from the patches.json index"""
+    try:
+        if index is None:
+            index = patch_index.load_local_index()
+        if index is None:
             available_files = list(Path(".").glob("patches.json*"))
-            logger.error(f"No patches file found. Available files: {[f.name for f in available_files]}")
+            logger.error(f"No valid patches file found. Available files: {[f.name for f in available_files]}")
             return None
-            
-        with open(patches_file) as f:
-            content = f.read().strip()
-            if not content:
-                logger.error("patches.json is empty")
-                return None
-            try:
-                patches = json.loads(content)
-            except json.JSONDecodeError as e:
-                logger.error(f"Invalid JSON in {patches_file.name}: {e}")
-                return None
         
-        logger.debug(f"Total patches found: {len(patches)}")
-        
-        if not isinstance(patches, list):
-            logger.error(f"Expected list of patches, got {type(patches)}")
-            return None
-            
-        versions = set()
-        for i, patch in enumerate(patches, 1):
-            if not isinstance(patch, dict):
-                logger.debug(f"Skipping non-dict patch at index {i}")
-                continue
-                
-            compatible_packages = patch.get("compatiblePackages")
-            logger.debug(f"Patch {i} compatiblePackages type: {type(compatible_packages)}")
-            
-            if isinstance(compatible_packages, dict):
-                logger.debug(f"Dict structure keys: {list(compatible_packages.keys())[:3]}...")
-                pkg_versions = compatible_packages.get(package_name, [])
-                if pkg_versions:
-                    versions.update(pkg_versions)
-            elif isinstance(compatible_packages, list):
-                logger.debug(f"List structure first item: {compatible_packages[0] if compatible_packages else 'empty'}")
-                for pkg in compatible_packages:
-                    if isinstance(pkg, dict) and pkg.get("name") == package_name:
-                        versions.update(pkg.get("versions", []))
-            else:
-                logger.debug(f"Unexpected compatiblePackages type in patch {i}")
-                
+        versions = patch_index.get_versions(index, package_name)
         if versions:
-            sorted_versions = natsorted(versions)
-            logger.debug(f"Final compatible versions for {package_name}: {sorted_versions}")
-            return sorted_versions
+            logger.debug(f"Final compatible versions for {package_name}: {versions}")
+            return versions
             
         logger.warning(f"No versions found for {package_name} in any patch")
         return None
@@ -95,63 +123,119 @@ def get_compatible_versions(package_name):
         logger.debug("Stack trace:", exc_info=True)
         return None
 
-def get_patches_json(source_url: str) -> dict:
-    """Get patches.json from the source URL"""
+def get_patches_index(source_url: str, max_age=None) -> dict | None:
+    """Get the compatibility index for patches.json, preferring the local copy"""
+    # Use local patches.json if it exists (downloaded by workflow)
+    index = patch_index.load_local_index()
+    if index is not None:
+        return index
+    
+    # Fallback to the patches.json asset of the newest release (source_url is an HTML page)
+    release = get_patch_release(source_url, max_age)
+    if release is None or "patches.json" not in release[1]:
+        logger.error(f"No patches.json asset found for {source_url}")
+        return None
     try:
-        # Use local patches.json if it exists (downloaded by workflow)
-        if Path("patches.json").exists():
-            with open("patches.json") as f:
-                content = f.read().strip()
-                if content:
-                    return json.loads(content)
-        
-        # Fallback to downloading from URL
-        response = requests.get(source_url)
+        response = http_cache.cached_get(release[1]["patches.json"], max_age)
         response.raise_for_status()
-        return response.json()
-    except (requests.RequestException, json.JSONDecodeError) as e:
+        return patch_index.load_index(response.content)
+    except requests.RequestException as e:
         logger.error(f"Failed to get patches.json: {e}")
-        return {}
+        return None
 
-def check_updates():
-    updates = {}
-    
-    for config_file in Path("configs/apps").glob("*.yaml"):
-        app_name = config_file.stem
-        with open(config_file) as f:
-            config = yaml.safe_load(f)
-        
-        # Check if app should use compatible version from patches.json
-        if config.get('patches', {}).get('fetchLatestCompatibleVersion', False):
-            # Get patches.json for version compatibility
-            patches_json = get_patches_json(config['patches']['source'])
-            latest_compatible = get_compatible_versions(config['package'])
-            
-            if latest_compatible:
-                current_apk = config.get('version', 'latest')
-                if current_apk != latest_compatible[-1]:
-                    updates[app_name] = {
-                        'apk': {'current': current_apk, 'latest': latest_compatible[-1]},
-                        'patch': {'current': 'latest', 'latest': 'latest'},
-                        'updated': datetime.now(UTC).isoformat()
-                    }
-            continue  # Skip APKMirror check for apps using patches.json
+def check_app(app_name, app_config, index=None, max_age=None, patches=None):
+    """Check a single app for updates, returning its update entry or None.
+
+    max_age overrides how long cached upstream responses are trusted. patches
+    is {'current', 'latest'} patch release tags; a new tag alone is an update.
+    """
+    patches = patches or {'current': state_store.UNRESOLVED_PATCHES, 'latest': state_store.UNRESOLVED_PATCHES}
+    new_patches = patches['latest'] not in (None, state_store.UNRESOLVED_PATCHES) and patches['latest'] != patches['current']
+
+    # Check if app should use compatible version from patches.json
+    if app_config.patches.fetch_latest_compatible:
+        latest_compatible = get_compatible_versions(app_config.package, index)
         
-        # For apps using APKMirror, check if they have source config
-        if 'source' in config and 'org' in config['source'] and 'repo' in config['source']:
-            current_apk = config.get('version', 'latest')
-            latest_apk = get_latest_version(config['source']['org'], config['source']['repo'])
-            
-            if current_apk != latest_apk:
-                updates[app_name] = {
-                    'apk': {'current': current_apk, 'latest': latest_apk},
-                    'patch': {'current': 'latest', 'latest': 'latest'},
+        if latest_compatible:
+            current_apk = app_config.version
+            if current_apk != latest_compatible[-1] or new_patches:
+                return {
+                    'apk': {'current': current_apk, 'latest': latest_compatible[-1]},
+                    'patch': dict(patches),
                     'updated': datetime.now(UTC).isoformat()
                 }
+        return None  # Skip APKMirror check for apps using patches.json
+    
+    # For apps using APKMirror, check if they have source config
+    if app_config.source.org and app_config.source.repo:
+        current_apk = app_config.version
+        latest_apk = get_latest_version(app_config.source.org, app_config.source.repo, max_age)
+        
+        if current_apk != latest_apk or new_patches:
+            return {
+                'apk': {'current': current_apk, 'latest': latest_apk},
+                'patch': dict(patches),
+                'updated': datetime.now(UTC).isoformat()
+            }
+    return None
+
+def check_updates(workers=None, max_age=None, refresh_patches=False):
+    """Check every app for a new APK or patches release.
+
+    With refresh_patches the local patches.json and patches.rvp are replaced
+    when a new patches release is out, so the compatibility index is current.
+    """
+    configs = config.load_apps()
+    lock = state_store.store.lock()
+    
+    # One patches release per patch source
+    releases = {}
+    for app_config in configs.values():
+        source = app_config.patches.source
+        if source and source not in releases:
+            try:
+                if refresh_patches:
+                    releases[source] = refresh_patch_files(source, max_age)
+                else:
+                    releases[source] = get_patch_version(source, max_age)
+            except (requests.RequestException, fetch.DownloadError) as e:
+                logger.error(f"Failed to resolve the patches release from {source}: {e}")
+                releases[source] = None
+    
+    # One patches.json index per patch source, shared by all apps
+    indexes = {}
+    for app_config in configs.values():
+        if app_config.patches.fetch_latest_compatible:
+            source = app_config.patches.source
+            if source not in indexes:
+                indexes[source] = get_patches_index(source, max_age)
+    
+    def check(item):
+        app_name, app_config = item
+        index = indexes.get(app_config.patches.source)
+        locked_patches = str((lock.get(app_name) or {}).get('apk_version', '')).partition(' ')[2]
+        patches = {
+            'current': locked_patches or state_store.UNRESOLVED_PATCHES,
+            'latest': releases.get(app_config.patches.source) or state_store.UNRESOLVED_PATCHES,
+        }
+        return app_name, check_app(app_name, app_config, index, max_age, patches)
+    
+    # Network checks run concurrently over the shared connection pool
+    started = datetime.now(UTC).isoformat()
+    updates = {}
+    checks = []
+    with ThreadPoolExecutor(max_workers=workers or CHECK_WORKERS) as executor:
+        for app_name, update in executor.map(check, configs.items()):
+            if update:
+                updates[app_name] = update
+                checks.append((app_name, update['apk']['current'], update['apk']['latest'],
+                               update['patch']['current'], update['patch']['latest'], update['updated']))
+            else:
+                checks.append((app_name, configs[app_name].version, None, None, None, datetime.now(UTC).isoformat()))
     
-    # Write updates to versions.json for the workflow
-    with open("versions.json", "w") as f:
-        json.dump(updates or {}, f)
+    # Keep the history in the state store; versions.json is exported for the workflow
+    state_store.store.record_checks(checks)
+    state_store.store.export_updates("versions.json", since=started)
     
     return updates
 
@@ -159,47 +243,30 @@ def update_lockfile(updates):
     if not updates:
         logger.warning("No updates to write to versions.lock")
         return
-        
-    lock = {}
-    try:
-        with open("versions.lock") as f:
-            lock = yaml.safe_load(f) or {}
-    except FileNotFoundError:
-        logger.info("Creating new versions.lock file")
     
-    for app, data in updates.items():
-        lock[app] = {
-            'apk_version': f"{data['apk']['latest']} {data['patch']['latest']}", # Format: "apk_version patch_version"
-            'last_checked': data['updated']
-        }
-        
-    with open("versions.lock", "w") as f:
-        yaml.safe_dump(lock, f, default_flow_style=False)
-    logger.info(f"Updated versions.lock with: {lock}")
+    # One transaction in the state store, then versions.lock is regenerated from it
+    state_store.store.record_updates(updates)
+    state_store.store.export_lock()
+    logger.info(f"Updated versions.lock for: {', '.join(updates)}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--app", required=True, help="App identifier (e.g., youtube)")
     parser.add_argument("--get-latest", action="store_true", help="Output the latest APK version for the app")
+    parser.add_argument("--workers", type=int, help="Number of concurrent update checks")
     args = parser.parse_args()
 
     if args.get_latest:
         # Read config from configs/apps/<app>.yaml
-        config_path = Path("configs", "apps", f"{args.app.lower()}.yaml")
-        if not config_path.exists():
-            logger.error(f"Config file for app '{args.app}' not found at {config_path}")
+        try:
+            app_config = config.load_app(args.app.lower())
+        except config.ConfigError as e:
+            logger.error(str(e))
             sys.exit(1)
             
-        with open(config_path) as f:
-            config = yaml.safe_load(f)
-            
         # Check if we should use patch-compatible version
-        if config.get("patches", {}).get("fetchLatestCompatibleVersion", False):
-            package = config.get("package")
-            if not package:
-                logger.error("App config must include 'package' when fetchLatestCompatibleVersion is true")
-                sys.exit(1)
-                
+        if app_config.patches.fetch_latest_compatible:
+            package = app_config.package
             compatible_versions = get_compatible_versions(package)
             if not compatible_versions:
                 logger.error(f"No patch-compatible versions found for {package}")
@@ -210,9 +277,8 @@ if __name__ == "__main__":
             sys.exit(0)
         else:
             # Use latest version from APKMirror
-            source = config.get("source", {})
-            org = source.get("org")
-            repo = source.get("repo")
+            org = app_config.source.org
+            repo = app_config.source.repo
             if not org or not repo:
                 logger.error("App config must include 'org' and 'repo' in the source field")
                 sys.exit(1)
@@ -224,7 +290,7 @@ if __name__ == "__main__":
             else:
                 sys.exit(1)
     else:
-        updates = check_updates()
+        updates = check_updates(args.workers)
         if updates:
             print("Updates available:")
             for app, data in updates.items():
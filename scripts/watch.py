@@ -0,0 +1,169 @@
+"""Watch daemon: poll upstream and build only the apps that changed.
+
+Every version_check_interval seconds (with random jitter, so several
+instances don't poll in lockstep) check_updates() is run and each result is
+compared against versions.lock. Each poll also resolves the patches release
+and refreshes patches.json and patches.rvp when its tag changes. Apps whose
+latest APK version or patches tag differs from the one recorded there are put
+on a local job queue and built by a bounded pool of workers through the
+pipeline; versions.lock is only updated once an app's build succeeds, so a
+failed build is retried on the next poll.
+"""
+import argparse
+import logging
+import os
+import queue
+import random
+import signal
+import threading
+import config
+import pipeline
+import planner
+import preflight
+import retention
+import runner
+import state_store
+import version_check
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 1
+JITTER = 0.1  # Fraction of the interval
+
+def locked_versions(lock, app_name):
+    """The (APK version, patches tag) versions.lock says was last built ("<apk> <patches>")"""
+    apk, _, patches = str((lock.get(app_name) or {}).get('apk_version', '')).partition(' ')
+    return apk, patches
+
+def changed_apps(updates, lock):
+    """Apps whose update differs from what versions.lock says was last built"""
+    changed = []
+    for app_name, update in updates.items():
+        apk, patches = locked_versions(lock, app_name)
+        latest_patches = update['patch']['latest']
+        new_apk = update['apk']['latest'] and apk != update['apk']['latest']
+        new_patches = latest_patches not in (None, state_store.UNRESOLVED_PATCHES) and patches != latest_patches
+        if new_apk or new_patches:
+            changed.append(app_name)
+    return changed
+
+def next_delay(interval, jitter=JITTER):
+    return max(1.0, interval * (1 + random.uniform(-jitter, jitter)))
+
+class Watcher:
+    """Polls for updates and feeds changed apps to a pool of build workers"""
+
+    def __init__(self, workers=DEFAULT_WORKERS, interval=None, build=True):
+        self.workers = max(1, workers)
+        self.interval = interval
+        self.build = build
+        self.jobs = queue.Queue()
+        self.pending = set()  # Queued or building; never queued twice
+        self.pending_lock = threading.Lock()
+        self.lock_file_lock = threading.Lock()
+        self.stop = threading.Event()
+
+    def poll(self):
+        """Check upstream once and queue every changed app; returns the apps queued"""
+        # Revalidate every poll: a cache entry trusted for version_check_interval
+        # would hide upstream changes for a whole interval; a 304 costs no body
+        updates = version_check.check_updates(max_age=0, refresh_patches=True)
+        queued = []
+        for app_name in changed_apps(updates, state_store.store.lock()):
+            with self.pending_lock:
+                if app_name in self.pending:
+                    continue
+                self.pending.add(app_name)
+            update = updates[app_name]
+            logger.info(f"{app_name}: {update['apk']['current']} → {update['apk']['latest']}, "
+                        f"patches {update['patch']['current']} → {update['patch']['latest']}, queued")
+            self.jobs.put((app_name, updates[app_name]))
+            queued.append(app_name)
+        return queued
+
+    def run(self, once=False):
+        """Poll until stopped (or once), building changed apps as they are queued"""
+        threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        while not self.stop.is_set():
+            try:
+                queued = self.poll()
+                if not queued and not self.pending:
+                    retention.print_summary(retention.collect())
+            except Exception as e:
+                logger.error(f"Update check failed: {e}")
+            if once:
+                break
+            interval = self.interval or config.load_build_rules().version_check_interval
+            delay = next_delay(interval)
+            logger.info(f"Next check in {delay:.0f}s")
+            self.stop.wait(delay)
+
+        if once:
+            self.jobs.join()
+        self.stop.set()
+        for _ in threads:
+            self.jobs.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _worker(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                return
+            app_name, update = job
+            try:
+                if self.stop.is_set():
+                    continue
+                if not self.build:
+                    with self.lock_file_lock:
+                        version_check.update_lockfile({app_name: update})
+                else:
+                    self._build(app_name, update)
+            except Exception as e:
+                logger.error(f"{app_name}: build failed: {e}")
+            finally:
+                with self.pending_lock:
+                    self.pending.discard(app_name)
+                self.jobs.task_done()
+
+    def _build(self, app_name, update):
+        if not preflight.preflight([app_name]):
+            return False
+        # Split the machine between workers; each app resumes from its own state file
+        scheduler = pipeline.Scheduler(
+            max(1, (os.cpu_count() or 1) // self.workers),
+            runner.available_memory_mb() // self.workers,
+            state_file=pipeline.STATE_FILE.with_name(f"{app_name}.json"),
+        )
+        pipeline.add_app(scheduler, app_name)
+        outputs, failed = scheduler.run()
+        if failed:
+            logger.error(f"{app_name}: failed stages: {', '.join(sorted(failed))}")
+            return False
+        logger.info(f"{app_name}: built {len(outputs)} stage(s)")
+        # The same record planner.py --record writes, so the next CI plan skips this build
+        patch_release = update['patch']['latest']
+        if patch_release == state_store.UNRESOLVED_PATCHES:
+            patch_release = None
+        with self.lock_file_lock:
+            planner.record(app_name, patch_release=patch_release)
+        return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Poll upstream and build apps whose version changed")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Concurrent app builds")
+    parser.add_argument("--interval", type=int, help="Seconds between checks (default: version_check_interval)")
+    parser.add_argument("--once", action="store_true", help="Check once, build what changed and exit")
+    parser.add_argument("--no-build", action="store_true", help="Only record changes in versions.lock")
+    args = parser.parse_args()
+
+    watcher = Watcher(args.workers, args.interval, build=not args.no_build)
+    # Finish the current builds on SIGTERM/SIGINT, drop whatever is still queued
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: watcher.stop.set())
+    watcher.run(once=args.once)
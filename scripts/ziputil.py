@@ -0,0 +1,230 @@
+"""Streaming zip entry copier and aligner.
+
+Copies entries between zip files without recompressing them: the compressed
+bytes of each kept entry are streamed from the source archive into a new local
+record, and a fresh central directory is written on close. Used to rewrite
+APKs at the zip level without decoding them.
+
+With align=True the copy also does zipalign's job: native libraries and
+resources.arsc are stored uncompressed so the device can mmap them in place,
+.so data starts on a page boundary and every other stored entry on 4 bytes.
+"""
+import os
+import struct
+import zipfile
+import zlib
+
+LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+END_RECORD = struct.Struct("<4s4H2LH")
+LOCAL_SIGNATURE = b"PK\x03\x04"
+CENTRAL_SIGNATURE = b"PK\x01\x02"
+END_SIGNATURE = b"PK\x05\x06"
+ZIP32_LIMIT = 0xFFFFFFFF
+DATA_DESCRIPTOR_FLAG = 0x08
+PAGE_SIZE = 16384  # Also satisfies 4 KB pages; required on devices with 16 KB pages
+STORED_ALIGN = 4
+
+class RawEntry:
+    """A zip entry located in its source archive, with its raw local header fields"""
+    __slots__ = ("info", "name", "extract_version", "flags", "compress_type",
+                 "dostime", "dosdate", "local_extra", "data_offset")
+
+    def __init__(self, info, name, extract_version, flags, compress_type,
+                 dostime, dosdate, local_extra, data_offset):
+        self.info = info
+        self.name = name
+        self.extract_version = extract_version
+        self.flags = flags
+        self.compress_type = compress_type
+        self.dostime = dostime
+        self.dosdate = dosdate
+        self.local_extra = local_extra
+        self.data_offset = data_offset
+
+    @property
+    def filename(self):
+        return self.info.filename
+
+def read_entries(zf: zipfile.ZipFile) -> list:
+    """Locate every entry's local record and compressed data in an open ZipFile"""
+    entries = []
+    fp = zf.fp
+    for info in zf.infolist():
+        fp.seek(info.header_offset)
+        header = LOCAL_HEADER.unpack(fp.read(LOCAL_HEADER.size))
+        if header[0] != LOCAL_SIGNATURE:
+            raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+        (_, extract_version, _, flags, compress_type, dostime, dosdate,
+         _, _, _, name_len, extra_len) = header
+        name = fp.read(name_len)
+        local_extra = fp.read(extra_len)
+        data_offset = info.header_offset + LOCAL_HEADER.size + name_len + extra_len
+        entries.append(RawEntry(info, name, extract_version, flags, compress_type,
+                                dostime, dosdate, local_extra, data_offset))
+    return entries
+
+def copy_raw(src_fp, entry, dst_fp):
+    """Stream an entry's compressed bytes from src_fp to dst_fp"""
+    src_fp.seek(entry.data_offset)
+    remaining = entry.info.compress_size
+    while remaining:
+        chunk = src_fp.read(min(remaining, 1 << 20))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated data for {entry.filename}")
+        dst_fp.write(chunk)
+        remaining -= len(chunk)
+
+class RawZipWriter:
+    """Write a zip file from raw, already-compressed entries"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.central = []
+
+    def add_raw(self, entry, src_fp, align=0):
+        """Append an entry, copying its compressed bytes untouched"""
+        info = entry.info
+        self._write_local(entry, entry.compress_type, info.compress_size, align)
+        copy_raw(src_fp, entry, self.fp)
+
+    def add_data(self, entry, data, compress_type, align=0):
+        """Append an entry whose payload has been re-encoded as data"""
+        self._write_local(entry, compress_type, len(data), align)
+        self.fp.write(data)
+
+    def add_stored(self, entry, src, align=0):
+        """Append an entry uncompressed, streaming its data from the file-like src"""
+        self._write_local(entry, zipfile.ZIP_STORED, entry.info.file_size, align)
+        crc = 0
+        while chunk := src.read(1 << 20):
+            crc = zlib.crc32(chunk, crc)
+            self.fp.write(chunk)
+        if crc != entry.info.CRC:
+            raise zipfile.BadZipFile(f"CRC mismatch for {entry.filename}")
+
+    def _write_local(self, entry, compress_type, compress_size, align):
+        info = entry.info
+        if info.file_size > ZIP32_LIMIT or compress_size > ZIP32_LIMIT:
+            raise zipfile.LargeZipFile(f"{entry.filename} needs zip64")
+
+        offset = self.fp.tell()
+        if offset > ZIP32_LIMIT:
+            raise zipfile.LargeZipFile("Archive needs zip64")
+
+        flags = entry.flags & ~DATA_DESCRIPTOR_FLAG
+        extra = alignment_extra(entry.local_extra, offset + LOCAL_HEADER.size + len(entry.name), align)
+        self.fp.write(LOCAL_HEADER.pack(
+            LOCAL_SIGNATURE, entry.extract_version, 0, flags, compress_type,
+            entry.dostime, entry.dosdate, info.CRC, compress_size, info.file_size,
+            len(entry.name), len(extra)))
+        self.fp.write(entry.name)
+        self.fp.write(extra)
+        self.central.append((entry, flags, compress_type, compress_size, offset))
+
+    def close(self):
+        """Write the central directory and end record"""
+        start = self.fp.tell()
+        for entry, flags, compress_type, compress_size, offset in self.central:
+            info = entry.info
+            self.fp.write(CENTRAL_HEADER.pack(
+                CENTRAL_SIGNATURE, info.create_version, info.create_system,
+                entry.extract_version, 0, flags, compress_type,
+                entry.dostime, entry.dosdate, info.CRC, compress_size, info.file_size,
+                len(entry.name), len(info.extra), len(info.comment), 0,
+                info.internal_attr, info.external_attr, offset))
+            self.fp.write(entry.name)
+            self.fp.write(info.extra)
+            self.fp.write(info.comment)
+        size = self.fp.tell() - start
+        count = len(self.central)
+        self.fp.write(END_RECORD.pack(END_SIGNATURE, 0, 0, count, count, size, start, 0))
+
+def alignment_extra(extra, data_start, align):
+    """Local extra field padded so the entry data starts on an align boundary.
+
+    Uses the Android alignment extra record (0xD935), replacing any existing one.
+    """
+    extra = strip_extra(extra, 0xD935)
+    if not align:
+        return extra
+
+    base = data_start + len(extra)
+    # Record header (4 bytes) plus the u16 alignment value
+    padding = (-(base + 6)) % align
+    return extra + struct.pack("<HHH", 0xD935, 2 + padding, align) + b"\0" * padding
+
+def strip_extra(extra, header_id):
+    """Remove all extra records with header_id from an extra field"""
+    kept = b""
+    pos = 0
+    while pos + 4 <= len(extra):
+        record_id, size = struct.unpack_from("<HH", extra, pos)
+        end = pos + 4 + size
+        if record_id != header_id:
+            kept += extra[pos:end]
+        pos = end
+    return kept
+
+def must_store(name):
+    """Entries the platform maps directly from the APK and so must not be compressed"""
+    return name.endswith(".so") or name == "resources.arsc"
+
+def alignment_for(name, page_size=PAGE_SIZE):
+    return page_size if name.endswith(".so") else STORED_ALIGN
+
+def rewrite(input_path, output_path, keep=None, align=False, page_size=PAGE_SIZE):
+    """Copy a zip's entries untouched, omitting those for which keep(name) is false.
+
+    With align, .so files and resources.arsc are stored uncompressed and stored
+    entries are aligned (see the module docstring). Returns (kept, dropped)
+    entry counts.
+    """
+    kept = dropped = 0
+    with zipfile.ZipFile(input_path) as zf, open(output_path, "wb") as out:
+        writer = RawZipWriter(out)
+        for entry in read_entries(zf):
+            if keep is not None and not keep(entry.filename):
+                dropped += 1
+                continue
+            if not align:
+                writer.add_raw(entry, zf.fp)
+            elif must_store(entry.filename) and entry.compress_type != zipfile.ZIP_STORED:
+                with zf.open(entry.info) as src:
+                    writer.add_stored(entry, src, alignment_for(entry.filename, page_size))
+            elif entry.compress_type == zipfile.ZIP_STORED:
+                writer.add_raw(entry, zf.fp, alignment_for(entry.filename, page_size))
+            else:
+                writer.add_raw(entry, zf.fp)
+            kept += 1
+        writer.close()
+    return kept, dropped
+
+def zipalign(path, page_size=PAGE_SIZE):
+    """Align an unsigned APK in place (signing after this keeps the layout)"""
+    path = str(path)
+    tmp_path = f"{path}.{os.getpid()}.align.tmp"
+    try:
+        rewrite(path, tmp_path, align=True, page_size=page_size)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return path
+
+def verify_alignment(path, page_size=PAGE_SIZE) -> list:
+    """Describe every entry that is compressed when it must be stored or misaligned"""
+    problems = []
+    with zipfile.ZipFile(path) as zf:
+        for entry in read_entries(zf):
+            name = entry.filename
+            stored = entry.compress_type == zipfile.ZIP_STORED
+            if must_store(name) and not stored:
+                problems.append(f"{name}: compressed, must be stored")
+                continue
+            if not stored:
+                continue
+            align = alignment_for(name, page_size)
+            if entry.data_offset % align:
+                problems.append(f"{name}: data at offset {entry.data_offset} is not {align}-byte aligned")
+    return problems
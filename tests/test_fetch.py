@@ -0,0 +1,115 @@
+"""fetch.py against a local HTTP server, with and without range support."""
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+import fetch  # noqa: E402
+
+DATA = os.urandom(64 << 10)
+ETAG = '"v1"'
+
+class Handler(BaseHTTPRequestHandler):
+    ranges = True  # Honour Range headers
+    drop_first = False  # Cut the first body request off halfway
+    short = 0  # Bytes missing from every close-delimited full-body response
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.headers.get("Range"))
+            drop = self.drop_first and len(server.requests) > 1 and not server.dropped
+            server.dropped |= drop
+        header = self.headers.get("Range")
+        if self.ranges and header:
+            start, end = (int(v) for v in header.removeprefix("bytes=").split("-"))
+            body = DATA[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(DATA)}")
+        else:
+            body = DATA
+            self.send_response(200)
+        self.send_header("ETag", ETAG)
+        if self.short and not header:
+            self.end_headers()
+            self.wfile.write(body[:-self.short])
+            return
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body[:len(body) // 2] if drop else body)
+
+    def log_message(self, *args):
+        pass
+
+class FetchTest(unittest.TestCase):
+    def serve(self, **options):
+        handler = type("TestHandler", (Handler,), options)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.lock = threading.Lock()
+        server.requests = []
+        server.dropped = False
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server, f"http://127.0.0.1:{server.server_address[1]}/app.apk"
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dest = Path(tmp.name) / "app.apk"
+        for patch in (mock.patch.object(fetch, "MIN_SEGMENT_SIZE", 8 << 10),
+                      mock.patch.object(fetch.time, "sleep")):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_ranged_download(self):
+        server, url = self.serve()
+        fetch.fetch(url, self.dest, connections=4, sha256=hashlib.sha256(DATA).hexdigest())
+        self.assertEqual(self.dest.read_bytes(), DATA)
+        self.assertEqual(len(server.requests), 5)  # Probe plus four segments
+        self.assertFalse(self.dest.with_name("app.apk.part.json").exists())
+
+    def test_dropped_connection_resumes_segment(self):
+        server, url = self.serve(drop_first=True)
+        fetch.fetch(url, self.dest, connections=4, sha256=hashlib.sha256(DATA).hexdigest())
+        self.assertEqual(self.dest.read_bytes(), DATA)
+        self.assertTrue(server.dropped)
+        self.assertEqual(len(server.requests), 6)
+
+    def test_server_ignoring_ranges(self):
+        server, url = self.serve(ranges=False)
+        fetch.fetch(url, self.dest, connections=4, sha256=hashlib.sha256(DATA).hexdigest())
+        self.assertEqual(self.dest.read_bytes(), DATA)
+        self.assertEqual(server.requests, ["bytes=0-0", None])
+
+    def test_short_response_is_incomplete(self):
+        server, url = self.serve(ranges=False, short=100)
+        with self.assertRaisesRegex(fetch.DownloadError, "connection closed"):
+            fetch.fetch(url, self.dest)
+        self.assertFalse(self.dest.exists())
+        self.assertEqual(len(server.requests), fetch.SEGMENT_RETRIES + 2)
+
+    def test_incomplete_segment_fails_verification(self):
+        part_file = self.dest.with_name("app.apk.part")
+        part_file.write_bytes(bytes(len(DATA)))
+        state = {"size": len(DATA), "segments": [[0, len(DATA) - 1, len(DATA) - 1]]}
+        with self.assertRaisesRegex(fetch.DownloadError, "Incomplete download"):
+            fetch._verify(part_file, state, len(DATA), None)
+
+    def test_sha_mismatch_discards_partial(self):
+        _, url = self.serve()
+        with self.assertRaisesRegex(fetch.DownloadError, "SHA-256 mismatch"):
+            fetch.fetch(url, self.dest, sha256="0" * 64)
+        self.assertFalse(self.dest.exists())
+        self.assertFalse(self.dest.with_name("app.apk.part").exists())
+
+if __name__ == "__main__":
+    unittest.main()
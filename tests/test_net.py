@@ -0,0 +1,65 @@
+"""net.py's shared session against a local stub HTTP server."""
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+import net  # noqa: E402
+
+class Handler(BaseHTTPRequestHandler):
+    failures = 0  # Answer this many requests with 503 first
+    delay = 0.0
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+            status = 503 if server.requests <= self.failures else 200
+        try:
+            time.sleep(self.delay)
+            body = str(status).encode()
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+class NetTest(unittest.TestCase):
+    def serve(self, **options):
+        handler = type("TestHandler", (Handler,), options)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.lock = threading.Lock()
+        server.requests = server.active = server.peak = 0
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+    def test_retries_5xx(self):
+        server, url = self.serve(failures=2)
+        response = net.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(server.requests, 3)
+
+    def test_host_concurrency_limit(self):
+        server, url = self.serve(delay=0.2)
+        with ThreadPoolExecutor(max_workers=net.HOST_CONCURRENCY * 3) as executor:
+            statuses = list(executor.map(lambda _: net.get(url).status_code, range(net.HOST_CONCURRENCY * 3)))
+        self.assertEqual(statuses, [200] * net.HOST_CONCURRENCY * 3)
+        self.assertEqual(server.peak, net.HOST_CONCURRENCY)
+
+if __name__ == "__main__":
+    unittest.main()